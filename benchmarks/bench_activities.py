@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Time and memory of building activities of the nodes.
+
+usage: python benchmarks/bench_activities.py [edges]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from seqdiag import parser
+from seqdiag.builder import ScreenNodeBuilder
+
+
+def generate(edges):
+    # nested calls: N0 -> N1 -> ... -> N9, then returns to N0
+    lines = ['seqdiag {']
+    for i in range(edges // 20):
+        for j in range(10):
+            lines.append('  N%d -> N%d;' % (j, j + 1))
+        for j in reversed(range(10)):
+            lines.append('  N%d <- N%d;' % (j, j + 1))
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def main(args=sys.argv[1:]):
+    edges = int(args[0]) if args else 100000
+    tree = parser.Parser(fast_lexer=True).parse_string(generate(edges))
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    diagram = ScreenNodeBuilder.build(tree)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    activities = sum(len(node.activities) for node in diagram.nodes)
+    print("%d edges, %d activities: %.2f sec  size %.1f MB  peak %.1f MB" %
+          (len(diagram.edges), activities, elapsed, current / 1048576.0,
+           peak / 1048576.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Time and memory of building and measuring deeply nested fragments.
+
+usage: python benchmarks/bench_altblocks.py [edges [depth]]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from blockdiag import imagedraw
+from blockdiag.utils.fontmap import FontMap
+
+from seqdiag import parser
+from seqdiag.builder import ScreenNodeBuilder
+from seqdiag.metrics import DiagramMetrics
+
+
+def generate(edges, depth):
+    # the same nest of fragments repeated; each level has its own edges
+    per_nest = max(edges // 1000, 1)
+    per_level = max(edges // (per_nest * depth), 1)
+    lines = ['seqdiag {']
+    for i in range(per_nest):
+        for level in range(depth):
+            lines.append('  %s {' % ('loop' if level % 2 else 'alt'))
+            for j in range(per_level):
+                lines.append('    N%d -> N%d;' % (level % 10, (j + 1) % 10))
+        lines.append('  }' * depth)
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def main(args=sys.argv[1:]):
+    edges = int(args[0]) if args else 50000
+    depth = int(args[1]) if len(args) > 1 else 20
+    tree = parser.Parser(fast_lexer=True).parse_string(generate(edges, depth))
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    diagram = ScreenNodeBuilder.build(tree)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("build: %d edges, %d altblocks: %.2f sec  size %.1f MB" %
+          (len(diagram.edges), len(diagram.altblocks), elapsed,
+           current / 1048576.0))
+
+    # extents are used by DiagramMetrics and DiagramDraw for each block
+    started = time.perf_counter()
+    for block in diagram.altblocks:
+        for _ in range(10):
+            block.xy, block.colwidth, block.colheight
+    elapsed = time.perf_counter() - started
+    print("extents: %.2f sec" % elapsed)
+
+    drawer = imagedraw.create('SVG', None)
+    started = time.perf_counter()
+    DiagramMetrics(diagram, drawer=drawer, fontmap=FontMap())
+    elapsed = time.perf_counter() - started
+    print("metrics: %.2f sec" % elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Memory of the namedtuple parse tree and the StatementTable.
+
+usage: python benchmarks/bench_compact_tree.py [edges]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from seqdiag import parser
+from seqdiag.compact import StatementTable
+
+
+def generate(edges):
+    lines = ['seqdiag {']
+    for i in range(edges):
+        if i % 100 == 0:
+            lines.append('  loop {')
+        lines.append('    N%d -> N%d [label = "message %d", note = "n"];' %
+                     (i % 50, (i + 1) % 50, i % 1000))
+        if i % 100 == 99:
+            lines.append('  }')
+    if edges % 100:
+        lines.append('  }')
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def namedtuple_tree(source):
+    return parser.Parser(fast_lexer=True).parse_string(source)
+
+
+def statement_table(source):
+    tree = parser.Parser(fast_lexer=True).iterparse_string(source)
+    return StatementTable.from_tree(tree)
+
+
+def main(args=sys.argv[1:]):
+    edges = int(args[0]) if args else 1000000
+    source = generate(edges)
+    print("%d edges, source: %.1f MB" % (edges, len(source) / 1048576.0))
+    for func in (namedtuple_tree, statement_table):
+        tracemalloc.start()
+        started = time.perf_counter()
+        tree = func(source)
+        elapsed = time.perf_counter() - started
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("%-16s %8.1f sec  size %8.1f MB  peak %8.1f MB" %
+              (func.__name__, elapsed, current / 1048576.0,
+               peak / 1048576.0))
+        del tree
+
+
+if __name__ == '__main__':
+    main()
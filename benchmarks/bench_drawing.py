@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Time of laying out and drawing a large diagram.
+
+usage: python benchmarks/bench_drawing.py [--profile] [edges]
+
+With --profile, the functions taking the most time are printed.
+"""
+
+import cProfile
+import pstats
+import sys
+import time
+
+from blockdiag.utils.fontmap import FontMap
+
+from seqdiag import parser
+from seqdiag.builder import ScreenNodeBuilder
+from seqdiag.drawer import DiagramDraw
+
+
+def generate(edges):
+    lines = ['seqdiag {']
+    for i in range(edges):
+        attrs = 'label = "message %d"' % (i % 20)
+        if i % 50 == 0:
+            attrs += ', note = "note %d"' % i
+        lines.append('  N%d -> N%d [%s];' % (i % 10, (i + 1) % 10, attrs))
+        if i % 500 == 499:
+            lines.append('  ... delay %d ...' % i)
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def draw(diagram):
+    started = time.perf_counter()
+    drawer = DiagramDraw('SVG', diagram, None, fontmap=FontMap())
+    layout = time.perf_counter() - started
+
+    started = time.perf_counter()
+    drawer.draw()
+    drawing = time.perf_counter() - started
+
+    return layout, drawing
+
+
+def main(args=sys.argv[1:]):
+    profile = '--profile' in args
+    args = [arg for arg in args if arg != '--profile']
+    edges = int(args[0]) if args else 50000
+
+    tree = parser.Parser(fast_lexer=True).parse_string(generate(edges))
+    diagram = ScreenNodeBuilder.build(tree)
+
+    if profile:
+        profiler = cProfile.Profile()
+        layout, drawing = profiler.runcall(draw, diagram)
+    else:
+        layout, drawing = draw(diagram)
+
+    print("%d edges: layout %.2f sec, drawing %.2f sec" %
+          (len(diagram.edges), layout, drawing))
+    if profile:
+        stats = pstats.Stats(profiler, stream=sys.stdout)
+        stats.sort_stats('tottime').print_stats(20)
+
+
+if __name__ == '__main__':
+    main()
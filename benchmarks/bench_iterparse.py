@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Peak memory of parsing (and building) a large diagram.
+
+usage: python benchmarks/bench_iterparse.py [edges]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from seqdiag import builder, parser
+
+
+def generate(edges):
+    lines = ['seqdiag {', '  default_fontsize = 12;']
+    for i in range(edges):
+        lines.append('  N%d -> N%d [label = "message %d"];' %
+                     (i % 50, (i + 1) % 50, i))
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def parse_string(source):
+    return parser.Parser(fast_lexer=True).parse_string(source)
+
+
+def iterparse_string(source):
+    return parser.Parser(fast_lexer=True).iterparse_string(source)
+
+
+def measure(source, func, build):
+    tracemalloc.start()
+    started = time.perf_counter()
+    tree = func(source)
+    if build:
+        builder.ScreenNodeBuilder.build(tree)
+    else:
+        for _ in tree.stmts:
+            pass
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(args=sys.argv[1:]):
+    edges = int(args[0]) if args else 20000
+    source = generate(edges)
+    print("source: %.1f MB" % (len(source) / 1024.0 / 1024))
+    for build in (False, True):
+        for func in (parse_string, iterparse_string):
+            elapsed, peak = measure(source, func, build)
+            name = func.__name__ + (' + build' if build else '')
+            print("%-24s %8.3f sec  peak %8.1f MB" %
+                  (name, elapsed, peak / 1024.0 / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Per-call overhead of seqdiag.parser on small diagrams.
+
+usage: python benchmarks/bench_parser.py [count]
+"""
+
+import shutil
+import sys
+import tempfile
+import timeit
+
+from seqdiag import parser
+from seqdiag.utils.diskcache import DiskCache
+
+SOURCE = """
+seqdiag {
+  browser  -> webserver [label = "GET /index.html"];
+  browser <-- webserver;
+  browser  -> webserver [label = "POST /blog/comment"];
+              webserver  -> database [label = "INSERT comment"];
+              webserver <-- database;
+  browser <-- webserver;
+}
+"""
+
+
+def rebuild_each_call():
+    # behavior before the grammar was shared: build everything per call
+    parser.Parser().parse_string(SOURCE)
+
+
+def shared_parser():
+    parser.parse_string(SOURCE)
+
+
+def main(args=sys.argv[1:]):
+    count = int(args[0]) if args else 2000
+    cachedir = tempfile.mkdtemp()
+    cached_parser = parser.Parser(cache=DiskCache(cachedir))
+
+    def cached():
+        cached_parser.parse_string(SOURCE)
+
+    try:
+        for name, func in (('rebuild_each_call', rebuild_each_call),
+                           ('shared_parser', shared_parser),
+                           ('cached_parser', cached)):
+            elapsed = min(timeit.repeat(func, number=count, repeat=3))
+            print("%-20s %8.1f us/call" % (name, elapsed / count * 1000000))
+    finally:
+        shutil.rmtree(cachedir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Time of building diagrams with many participants.
+
+usage: python benchmarks/bench_participants.py [participants...]
+"""
+
+import sys
+import time
+
+from seqdiag import parser
+from seqdiag.builder import ScreenNodeBuilder
+
+
+def generate(participants):
+    # groups of 10 participants; each one calls the next one
+    lines = ['seqdiag {']
+    for i in range(0, participants, 10):
+        members = ' '.join('N%d;' % j for j in range(i, i + 10))
+        lines.append('  group { %s }' % members)
+    for i in range(participants - 1):
+        lines.append('  N%d -> N%d;' % (i, i + 1))
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def main(args=sys.argv[1:]):
+    counts = [int(arg) for arg in args] or [1000, 2000, 4000, 8000]
+    for participants in counts:
+        source = generate(participants)
+        tree = parser.Parser(fast_lexer=True).parse_string(source)
+
+        started = time.perf_counter()
+        diagram = ScreenNodeBuilder.build(tree)
+        elapsed = time.perf_counter() - started
+        print("%6d participants: %.3f sec" % (len(diagram.nodes), elapsed))
+
+
+if __name__ == '__main__':
+    main()
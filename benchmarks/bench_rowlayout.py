@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Time of the layout of rows by each backend of seqdiag.rowlayout.
+
+usage: python benchmarks/bench_rowlayout.py [edges ...]
+
+The inputs are the measured sizes of a diagram having one fragment per
+10 edges and a note per 50 edges; the texts are not measured here.
+Each step is timed 3 times and the fastest run is printed.
+"""
+
+import random
+import sys
+import time
+
+from seqdiag import rowlayout
+
+
+def generate(edges):
+    rand = random.Random(0)
+    heights = [10 + rand.choice([0, 0, 19, 38]) for _ in range(edges)]
+    leftnotes = [0] * edges
+    rightnotes = [0] * edges
+    for i in range(0, edges, 50):
+        rightnotes[i] = 64
+
+    tops = []
+    bottoms = []
+    for i in range(0, edges - 10, 10):
+        tops.append((i, 1))
+        bottoms.append((i + rand.randrange(1, 10), 1))
+
+    node_heights = [40] * (edges + 1)
+    span_heights = [40] * (edges + 1)
+    return (heights, leftnotes, rightnotes, tops, bottoms,
+            node_heights, span_heights)
+
+
+def measure(backend, inputs):
+    (heights, leftnotes, rightnotes, tops, bottoms,
+     node_heights, span_heights) = inputs
+    edges = len(heights)
+    elapsed = []
+
+    start = time.perf_counter()
+    backend.edge_heights(heights, leftnotes, rightnotes, 40, 1)
+    elapsed.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    backend.block_spans(edges, tops, bottoms, 8)
+    elapsed.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    backend.offsets(node_heights, span_heights)
+    elapsed.append(time.perf_counter() - start)
+
+    return elapsed
+
+
+def main(args):
+    sizes = [int(arg) for arg in args] or [10000, 100000, 1000000]
+    backends = ['python']
+    if rowlayout.numpy is not None:
+        backends.append('numpy')
+    else:
+        print("numpy is not installed; timing the python backend only")
+
+    for name in backends:  # warm up
+        measure(rowlayout.get_backend(name), generate(100))
+
+    print("%9s %7s %9s %9s %9s" % ('edges', 'backend', 'heights', 'spans',
+                                   'offsets'))
+    for size in sizes:
+        inputs = generate(size)
+        for name in backends:
+            backend = rowlayout.get_backend(name)
+            runs = [measure(backend, inputs) for _ in range(3)]
+            elapsed = [min(times) for times in zip(*runs)]
+            print("%9d %7s %8.1fms %8.1fms %8.1fms" %
+                  ((size, name) + tuple(t * 1000 for t in elapsed)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
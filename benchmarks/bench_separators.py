@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Time of building diagrams with many separators.
+
+usage: python benchmarks/bench_separators.py [edges [separators]]
+
+The diagram is also built with 1/8 of the edges and separators; the time
+grows about 8x when keeping the separators out of the edges is linear,
+and about 64x when it is quadratic.
+"""
+
+import sys
+import time
+
+from seqdiag import parser
+from seqdiag.builder import ScreenNodeBuilder
+
+
+def generate(edges, separators):
+    interval = max(edges // max(separators, 1), 1)
+    lines = ['seqdiag {']
+    for i in range(edges):
+        lines.append('  N%d -> N%d;' % (i % 10, (i + 1) % 10))
+        if i % interval == interval - 1 and separators:
+            if separators % 2:
+                lines.append('  === divider %d ===' % i)
+            else:
+                lines.append('  ... delay %d ...' % i)
+            separators -= 1
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def build_time(edges, separators):
+    source = generate(edges, separators)
+    tree = parser.Parser(fast_lexer=True).parse_string(source)
+
+    timings = []
+    for _ in range(3):
+        started = time.perf_counter()
+        diagram = ScreenNodeBuilder.build(tree)
+        timings.append(time.perf_counter() - started)
+
+    print("%d edges, %d separators: %.2f sec" %
+          (len(diagram.edges), len(diagram.separators), min(timings)))
+    return min(timings)
+
+
+def main(args=sys.argv[1:]):
+    edges = int(args[0]) if args else 100000
+    separators = int(args[1]) if len(args) > 1 else 10000
+
+    small = build_time(edges // 8, separators // 8)
+    large = build_time(edges, separators)
+    print("ratio: %.1fx (8x when linear, 64x when quadratic)" %
+          (large / small))
+
+
+if __name__ == '__main__':
+    main()
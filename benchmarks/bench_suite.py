@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Time and memory of each phase of rendering generated diagrams.
+
+usage: python benchmarks/bench_suite.py [options] [case ...]
+
+Diagrams are generated from the parameters of each case (see CASES); the
+phases from tokenizing to saving are timed separately, and the peak memory
+allocated in each phase is traced in an extra run.  Each run starts with
+an empty text cache, so the texts are measured in each run.  With --output, the
+results are written as JSON; with --compare, the times are compared with
+the results of an earlier run and the command fails if any phase of any
+case is slower by more than --threshold.
+
+    python benchmarks/bench_suite.py --label $(git rev-parse HEAD) \
+        --output base.json
+    (change the code)
+    python benchmarks/bench_suite.py --compare base.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+
+from blockdiag.utils.fontmap import FontMap
+
+import seqdiag
+from seqdiag import parser
+from seqdiag.builder import ScreenNodeBuilder
+from seqdiag.drawer import DiagramDraw
+from seqdiag.metrics import DiagramMetrics
+
+PHASES = ('tokenize', 'parse', 'sort_tree', 'build', 'metrics', 'draw',
+          'save')
+
+DEFAULTS = OrderedDict([
+    ('participants', 10),  # number of nodes
+    ('edges', 1000),
+    ('depth', 0),  # nesting depth of alt/loop fragments
+    ('separators', 0),  # a separator per this number of edges
+    ('notes', 0.0),  # ratio of edges having a note
+    ('label_length', 10),  # characters of a label; 0 for no labels
+    ('seed', 0),
+])
+
+CASES = OrderedDict([
+    ('small', dict(edges=50)),
+    ('edges-10k', dict(edges=10000)),
+    ('participants-100', dict(participants=100, edges=5000)),
+    ('fragments', dict(edges=5000, depth=10)),
+    ('separators', dict(edges=5000, separators=10)),
+    ('notes', dict(edges=5000, notes=0.5)),
+    ('long-labels', dict(edges=1000, label_length=200)),
+    ('mixed', dict(participants=30, edges=10000, depth=5, separators=50,
+                   notes=0.1, label_length=40)),
+])
+
+WORDS = ('request', 'response', 'data', 'user', 'session', 'cache', 'query',
+         'update', 'commit', 'event')
+
+
+def generate(participants, edges, depth, separators, notes, label_length,
+             seed):
+    """Returns the source of a diagram
+
+    The edges are split into chunks of fragments nested *depth* levels (or
+    a flat sequence if depth is 0).
+    """
+    rand = random.Random(seed)
+    lines = ['seqdiag {']
+    indent = 1
+    opened = 0
+    per_fragment = max(edges // max(depth * 10, 1), 1)
+    for i in range(edges):
+        if depth and i % per_fragment == 0:
+            if opened == depth:
+                while opened:
+                    indent -= 1
+                    opened -= 1
+                    lines.append('  ' * indent + '}')
+            else:
+                kind = 'alt' if opened % 2 else 'loop'
+                lines.append('  ' * indent + '%s {' % kind)
+                indent += 1
+                opened += 1
+
+        if separators and opened == 0 and i and i % separators == 0:
+            lines.append('  ' * indent + '=== separator %d ===' % i)
+
+        node1, node2 = rand.sample(range(participants), 2)
+        attrs = []
+        if label_length:
+            label = ''
+            while len(label) < label_length:
+                label += rand.choice(WORDS) + ' '
+            attrs.append('label = "%s"' % label[:label_length].strip())
+        if rand.random() < notes:
+            attrs.append('%s = "note of\\nedge %d"' %
+                         (rand.choice(['note', 'leftnote', 'rightnote']), i))
+
+        lines.append('  ' * indent + 'N%d -> N%d [%s];' %
+                     (node1, node2, ', '.join(attrs)))
+
+    while opened:
+        indent -= 1
+        opened -= 1
+        lines.append('  ' * indent + '}')
+
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def phases(source, _format):
+    """Yields the name of each phase after running it
+
+    The sizes of texts cached by earlier runs are cleared first, so each
+    run measures all texts of the diagram.
+    """
+    if DiagramMetrics.textcache is not None:
+        DiagramMetrics.textcache.clear()
+
+    parse = parser.default_parser
+    tokens = parse.tokenize(source)
+    yield 'tokenize'
+
+    tree = parse.parse(tokens)
+    yield 'parse'
+
+    tree = parser.sort_tree(tree)
+    yield 'sort_tree'
+
+    diagram = ScreenNodeBuilder.build(tree)
+    yield 'build'
+
+    # DiagramDraw creates the DiagramMetrics (and an empty canvas)
+    with tempfile.NamedTemporaryFile(suffix='.' + _format.lower()) as fp:
+        drawer = DiagramDraw(_format, diagram, fp.name, fontmap=FontMap())
+        yield 'metrics'
+
+        drawer.draw()
+        yield 'draw'
+
+        drawer.save()
+        yield 'save'
+
+
+def measure_time(source, _format):
+    times = OrderedDict()
+    started = time.perf_counter()
+    for phase in phases(source, _format):
+        now = time.perf_counter()
+        times[phase] = now - started
+        started = now
+
+    return times
+
+
+def measure_memory(source, _format):
+    # tracing restarts on each phase, so the peak of a phase counts only
+    # the memory allocated in it
+    peaks = OrderedDict()
+    tracemalloc.start()
+    try:
+        for phase in phases(source, _format):
+            peaks[phase] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            tracemalloc.start()
+    finally:
+        tracemalloc.stop()
+
+    return peaks
+
+
+def run_case(params, _format, repeat, memory):
+    source = generate(**params)
+    runs = [measure_time(source, _format) for _ in range(repeat)]
+    result = OrderedDict()
+    result['params'] = params
+    result['phases'] = OrderedDict((phase, OrderedDict()) for phase in PHASES)
+    for phase in PHASES:
+        result['phases'][phase]['time'] = min(run[phase] for run in runs)
+
+    if memory:
+        for phase, peak in measure_memory(source, _format).items():
+            result['phases'][phase]['peak_memory'] = peak
+
+    result['time'] = sum(p['time'] for p in result['phases'].values())
+    return result
+
+
+def compare(results, baseline, threshold):
+    """Prints the ratio of times to the baseline; returns the regressions"""
+    regressions = []
+    print("\ncompared with %s (threshold %+.0f%%)" %
+          (baseline.get('label') or baseline.get('seqdiag'), threshold * 100))
+    for name, case in results['cases'].items():
+        base = baseline['cases'].get(name)
+        if base is None:
+            continue
+        if base['params'] != case['params']:
+            print("%-20s parameters differ; skipped" % name)
+            continue
+
+        ratios = []
+        for phase in PHASES:
+            old = base['phases'][phase]['time']
+            new = case['phases'][phase]['time']
+            ratio = new / old if old else 1.0
+            ratios.append('%s %.2fx' % (phase, ratio))
+            # ignore the noise of the phases shorter than 1ms
+            if ratio > 1 + threshold and new - old > 0.001:
+                regressions.append((name, phase, old, new))
+        print("%-20s %s" % (name, ', '.join(ratios)))
+
+    for name, phase, old, new in regressions:
+        print("REGRESSION: %s: %s %.1fms -> %.1fms" %
+              (name, phase, old * 1000, new * 1000))
+
+    return regressions
+
+
+def main(args=sys.argv[1:]):
+    p = argparse.ArgumentParser(prog='bench_suite.py')
+    p.add_argument('cases', nargs='*', metavar='case',
+                   help='cases to run (default: all of %s)' %
+                        ', '.join(CASES))
+    p.add_argument('-T', '--type', default='SVG', dest='format',
+                   choices=['SVG', 'PNG', 'PDF'], help='output format')
+    p.add_argument('-r', '--repeat', type=int, default=3,
+                   help='times to run each case; the fastest time of each '
+                        'phase is reported (default: 3)')
+    p.add_argument('--scale', type=float, default=1.0,
+                   help='multiply the number of edges of cases by SCALE')
+    p.add_argument('--no-memory', dest='memory', action='store_false',
+                   help='do not trace the peak memory')
+    p.add_argument('-o', '--output', metavar='FILE',
+                   help='write the results to FILE as JSON')
+    p.add_argument('--label',
+                   help='label of the results, e.g. the commit of the code')
+    p.add_argument('--compare', metavar='FILE',
+                   help='compare with the results in FILE')
+    p.add_argument('--threshold', type=float, default=0.1,
+                   help='ratio of slowdown reported as regression by '
+                        '--compare (default: 0.1)')
+    options = p.parse_args(args)
+
+    for name in options.cases:
+        if name not in CASES:
+            p.error("unknown case: %s" % name)
+
+    results = OrderedDict()
+    results['label'] = options.label
+    results['seqdiag'] = seqdiag.__version__
+    results['python'] = platform.python_version()
+    results['platform'] = platform.platform()
+    results['format'] = options.format
+    results['cases'] = OrderedDict()
+
+    # load fonts and modules before timing
+    measure_time(generate(**dict(DEFAULTS, edges=10)), options.format)
+
+    print("%-20s %s %9s %11s" % ('case', ' '.join('%9s' % phase
+                                                  for phase in PHASES),
+                                 'total', 'peak'))
+    for name in options.cases or CASES:
+        params = OrderedDict(DEFAULTS)
+        params.update(CASES[name])
+        params['edges'] = max(int(params['edges'] * options.scale), 1)
+
+        result = run_case(params, options.format, options.repeat,
+                          options.memory)
+        results['cases'][name] = result
+
+        times = ['%7.1fms' % (result['phases'][phase]['time'] * 1000)
+                 for phase in PHASES]
+        peak = max(p.get('peak_memory', 0)
+                   for p in result['phases'].values())
+        print("%-20s %s %7.1fms %8.1fMB" % (name, ' '.join(times),
+                                            result['time'] * 1000,
+                                            peak / 1024.0 / 1024.0))
+        sys.stdout.flush()
+
+    if options.output:
+        with open(options.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+    if options.compare:
+        with open(options.compare) as fp:
+            baseline = json.load(fp)
+        if compare(results, baseline, options.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
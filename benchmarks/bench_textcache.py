@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Time of laying out a label-heavy diagram with and without TextCache.
+
+usage: python benchmarks/bench_textcache.py [edges [labels]]
+"""
+
+import sys
+import time
+
+from blockdiag.utils.fontmap import FontMap
+
+from seqdiag import parser
+from seqdiag.builder import ScreenNodeBuilder
+from seqdiag.drawer import DiagramDraw
+from seqdiag.metrics import DiagramMetrics
+from seqdiag.utils.textcache import TextCache
+
+WORDS = ['200 OK', 'ack', 'retry', 'GET /index.html', 'timeout',
+         'POST /api/v1/items (application/json)']
+
+
+def generate(edges, labels):
+    lines = ['seqdiag {']
+    for i in range(edges):
+        label = '%s %d' % (WORDS[i % len(WORDS)], i % labels)
+        note = ''
+        if i % 10 == 0:
+            note = ', note = "%s"' % label
+        lines.append('  N%d -> N%d [label = "%s"%s];' %
+                     (i % 5, (i + 1) % 5, label, note))
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def measure(tree, textcache):
+    DiagramMetrics.textcache = textcache
+    diagram = ScreenNodeBuilder.build(tree)
+    started = time.perf_counter()
+    DiagramDraw('SVG', diagram, None, fontmap=FontMap())
+    return time.perf_counter() - started
+
+
+def main(args=sys.argv[1:]):
+    edges = int(args[0]) if args else 5000
+    labels = int(args[1]) if len(args) > 1 else 20
+    tree = parser.Parser(fast_lexer=True).parse_string(generate(edges,
+                                                                labels))
+    elapsed = measure(tree, None)
+    print("%d edges, %d labels: %.2f sec (no cache)" %
+          (edges, labels, elapsed))
+
+    textcache = TextCache()
+    for run in ('cold', 'warm'):
+        elapsed = measure(tree, textcache)
+        print("%d edges, %d labels: %.2f sec (%s cache; %r)" %
+              (edges, labels, elapsed, run, textcache.stats()))
+
+
+if __name__ == '__main__':
+    main()
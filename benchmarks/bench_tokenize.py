@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Tokenizer throughput on a large machine-generated diagram.
+
+usage: python benchmarks/bench_tokenize.py [edges]
+"""
+
+import sys
+import time
+
+from seqdiag import parser
+
+
+def generate(edges):
+    lines = ['seqdiag {']
+    for i in range(edges):
+        lines.append('  N%d -> N%d [label = "message %d"];  // #%d' %
+                     (i % 50, (i + 1) % 50, i, i))
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def main(args=sys.argv[1:]):
+    edges = int(args[0]) if args else 100000
+    source = generate(edges)
+    for name, p in (('make_tokenizer', parser.Parser()),
+                    ('fast_tokenizer', parser.Parser(fast_lexer=True))):
+        started = time.perf_counter()
+        tokens = p.tokenize(source)
+        elapsed = time.perf_counter() - started
+        print("%-16s %8.3f sec (%d tokens)" % (name, elapsed, len(tokens)))
+
+
+if __name__ == '__main__':
+    main()
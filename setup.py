@@ -55,6 +55,9 @@ setup(
         'blockdiag >= 3.0.0',
     ],
     extras_require={
+        'numpy': [
+            'numpy',
+        ],
         'testing': [
             'nose',
             'flake8',
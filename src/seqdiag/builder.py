@@ -13,26 +13,44 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+from collections import defaultdict, namedtuple
+from functools import partial
+
 from blockdiag.utils import XY, unquote
 
 from seqdiag import parser
-from seqdiag.elements import (AltBlock, Diagram, DiagramEdge, DiagramNode,
-                              EdgeSeparator, NodeGroup)
+from seqdiag.compact import StatementTable
+from seqdiag.elements import BuildContext, DiagramEdge, NodeGroup
+
+Update = namedtuple('Update', 'diagram dirty_rows rebuilt')
 
 
 class DiagramTreeBuilder(object):
+    def __init__(self, context=None):
+        if context is None:
+            context = BuildContext()
+
+        self.context = context
+
     def build(self, tree):
-        self.diagram = Diagram()
+        if isinstance(tree, StatementTable):
+            tree = tree.to_tree()
+
+        self.diagram = self.context.Diagram()
+        self.rows = []  # edges and separators in order of appearance
+        self.altblocks = []  # in pre-order; including empty ones
         self.diagram = self.instantiate(self.diagram, None, tree)
+        self.layout()
 
+        return self.diagram
+
+    def layout(self):
         self.update_node_order()
         self.update_edge_order()
+        self.update_altblock_extent()
         self.update_altblock_ylevel()
         self.diagram.colwidth = len(self.diagram.nodes)
-        self.diagram.colheight = len(self.diagram.edges) + 1
-
-        for sep in self.diagram.separators:
-            self.diagram.edges.remove(sep)
+        self.diagram.colheight = len(self.rows) + 1
 
         if self.diagram.activation != 'none':
             self.create_activities()
@@ -40,24 +58,76 @@ class DiagramTreeBuilder(object):
         if self.diagram.autonumber:
             self.update_label_numbered()
 
-        return self.diagram
+    def update_edge_order(self, start=0):
+        for i in range(start, len(self.rows)):
+            self.rows[i].order = i
 
-    def update_edge_order(self):
-        for i, edge in enumerate(self.diagram.edges):
-            edge.order = i
-
-        height = len(self.diagram.edges) + 1
+        height = len(self.rows) + 1
         for group in self.diagram.groups:
             group.colheight = height
 
+    def update_altblock_extent(self, altblocks=None):
+        # The rows of an altblock include the rows of its sub-blocks.  Visit
+        # the sub-blocks first (reversed pre-order) and skip over their rows,
+        # so each row is scanned only once.
+        if altblocks is None:
+            altblocks = self.altblocks
+
+        visited = {}  # start row -> the outermost altblock visited
+        for altblock in reversed(altblocks):
+            top = bottom = left = right = None
+            i = altblock.start
+            while i < altblock.end:
+                subblock = visited.get(i)
+                if subblock:
+                    i = subblock.end
+                    if subblock.top is None:
+                        continue
+
+                    y1, y2 = subblock.top, subblock.bottom
+                    x1, x2 = subblock.left, subblock.right
+                else:
+                    edge = self.rows[i]
+                    i += 1
+                    if not isinstance(edge, DiagramEdge):
+                        continue
+
+                    y1 = y2 = edge.order
+                    x1, x2 = edge.node1.xy.x, edge.node2.xy.x
+                    if x1 > x2:
+                        x1, x2 = x2, x1
+
+                if top is None:
+                    top, bottom, left, right = y1, y2, x1, x2
+                else:
+                    bottom = y2
+                    left = min(left, x1)
+                    right = max(right, x2)
+
+            altblock.top, altblock.bottom = top, bottom
+            altblock.left, altblock.right = left, right
+            if altblock.start < altblock.end:
+                # empty blocks have no rows to skip over; registering them
+                # would stop the scan of the enclosing block at their start
+                visited[altblock.start] = altblock
+
+        # empty fragments have nothing to draw
+        self.diagram.altblocks = [b for b in self.altblocks
+                                  if b.top is not None]
+
     def update_altblock_ylevel(self):
-        altblocks = self.diagram.altblocks
-        for i in range(len(self.diagram.edges) + 1):
-            blocks = [b for b in altblocks if b.edges[0].order == i]
+        # altblocks starting (ending) at the same row; in order of appearance
+        tops = defaultdict(list)
+        bottoms = defaultdict(list)
+        for altblock in self.diagram.altblocks:
+            tops[altblock.top].append(altblock)
+            bottoms[altblock.bottom].append(altblock)
+
+        for blocks in tops.values():
             for j, altblock in enumerate(reversed(blocks)):
                 altblock.ylevel_top = j + 1
 
-            blocks = [b for b in altblocks if b.edges[-1].order == i]
+        for blocks in bottoms.values():
             for j, altblock in enumerate(reversed(blocks)):
                 altblock.ylevel_bottom = j + 1
 
@@ -75,47 +145,58 @@ class DiagramTreeBuilder(object):
             if node.activated:
                 active_nodes[node] = 1
 
-        edge_count = len(self.diagram.edges) + len(self.diagram.separators)
-        for i in range(edge_count):
-            match = [e for e in self.diagram.edges if e.order == i]
-            if match:
-                edge = match[0]
-                if edge.activate is False:
-                    pass
-                elif edge.dir == 'forward':
-                    if edge.node2 in active_nodes:
-                        active_nodes[edge.node2] += 1
-                    else:
-                        active_nodes[edge.node2] = 1
-                elif edge.dir == 'back':
-                    if edge.node2 in active_nodes:
-                        active_nodes[edge.node2] -= 1
-                    else:
-                        active_nodes[edge.node2] = 0
-
-            for node in active_nodes:
-                if active_nodes[node] > 0:
-                    for index in range(active_nodes[node]):
-                        node.activate(i, index)
+        # Sweep the edges once; the activation level of a node changes only
+        # at the rows of edges to the node.  starts[node] holds the first
+        # row of each active level.
+        starts = dict((node, [0]) for node in active_nodes)
+        for edge in self.diagram.edges:
+            node = edge.node2
+            if edge.activate is False:
+                continue
+            elif edge.dir == 'forward':
+                active_nodes[node] = active_nodes.get(node, 0) + 1
+            elif edge.dir == 'back':
+                if node in active_nodes:
+                    active_nodes[node] -= 1
+                else:
+                    active_nodes[node] = 0
+            else:
+                continue
+
+            levels = starts.setdefault(node, [])
+            while len(levels) < active_nodes[node]:
+                node.deactivate(len(levels))
+                levels.append(edge.order)
+
+            while len(levels) > max(active_nodes[node], 0):
+                start = levels.pop()
+                if start < edge.order:
+                    node.activate(start, len(levels), edge.order - 1)
+
+        last_row = len(self.rows) - 1
+        for node, levels in starts.items():
+            for index, start in enumerate(levels):
+                node.activate(start, index, last_row)
 
         for node in self.diagram.nodes:
             node.deactivate()
+            node.index_activities()
 
     def update_node_order(self):
         x = 0
-        uniq = []
+        uniq = set()
 
         for node in self.diagram.nodes:
             if node not in uniq:
                 node.xy = XY(x, 0)
-                uniq.append(node)
+                uniq.add(node)
                 x += 1
 
                 if node.group:
                     for subnode in node.group.nodes:
                         if subnode not in uniq:
                             subnode.xy = XY(x, 0)
-                            uniq.append(subnode)
+                            uniq.add(subnode)
                             x += 1
 
         for group in self.diagram.groups:
@@ -136,19 +217,36 @@ class DiagramTreeBuilder(object):
             node.group = group
 
     def instantiate(self, group, block, tree):
-        for stmt in tree.stmts:
+        # Nested statements are expanded with a stack instead of recursion.
+        # An item of the stack is an iterator of statements (with the group
+        # and the block they belong to) or a callback to run after all of the
+        # items above it are done.
+        root = group
+        stack = [(group, block, iter(tree.stmts))]
+        while stack:
+            item = stack.pop()
+            if callable(item):
+                item()
+                continue
+
+            group, block, stmts = item
+            stmt = next(stmts, None)
+            if stmt is None:
+                continue
+
+            stack.append(item)
             if isinstance(stmt, parser.Node):
-                node = DiagramNode.get(stmt.id)
+                node = self.context.DiagramNode.get(stmt.id)
                 node.set_attributes(stmt.attrs)
                 self.append_node(node, group)
 
             elif isinstance(stmt, parser.Edge):
-                self.instantiate_edge(group, block, stmt)
+                stack.extend(self.instantiate_edge(group, block, stmt))
 
             elif isinstance(stmt, parser.Group):
-                node = NodeGroup.get(None)
-                self.instantiate(node, block, stmt)
-                self.diagram.groups.append(node)
+                node = self.context.NodeGroup.get(None)
+                stack.append(partial(self.diagram.groups.append, node))
+                stack.append((node, block, iter(stmt.stmts)))
 
             elif isinstance(stmt, parser.Attr):
                 if block:
@@ -157,77 +255,324 @@ class DiagramTreeBuilder(object):
                     group.set_attribute(stmt)
 
             elif isinstance(stmt, parser.Separator):
-                sep = EdgeSeparator(stmt.type, unquote(stmt.value))
+                sep = self.context.EdgeSeparator(stmt.type,
+                                                 unquote(stmt.value))
                 sep.group = group
                 self.diagram.separators.append(sep)
-                group.edges.append(sep)
+                self.rows.append(sep)
 
             elif isinstance(stmt, parser.Fragment):
-                subblock = AltBlock(stmt.type, stmt.id)
+                subblock = self.context.AltBlock(stmt.type, stmt.id)
+                subblock.rows = self.rows
+                subblock.start = len(self.rows)
                 if block:
                     subblock.xlevel = block.xlevel + 1
-                self.diagram.altblocks.append(subblock)
+                self.altblocks.append(subblock)
 
-                self.instantiate(group, subblock, stmt)
-                if block:
-                    for edge in subblock.edges:
-                        block.edges.append(edge)
+                stack.append(partial(self.close_altblock, subblock))
+                stack.append((group, subblock, iter(stmt.stmts)))
 
             elif isinstance(stmt, parser.Extension):
                 if stmt.type == 'class':
                     name = unquote(stmt.name)
-                    Diagram.classes[name] = stmt
+                    self.context.classes[name] = stmt
                 elif stmt.type == 'plugin':
                     self.diagram.set_plugin(stmt.name, stmt.attrs)
 
-        return group
+        return root
+
+    def close_altblock(self, block):
+        block.end = len(self.rows)
 
     def instantiate_edge(self, group, block, stmt):
-        from_node = DiagramNode.get(stmt.from_node)
-        self.append_node(from_node, group)
-
-        to_node = DiagramNode.get(stmt.to_node)
-        self.append_node(to_node, group)
-
-        edge = DiagramEdge(from_node, to_node)
-        edge.set_dir(stmt.edge_type)
-        edge.set_attributes(stmt.attrs)
-
-        if edge.dir in ('forward', 'both'):
-            forward = edge.duplicate()
-            forward.dir = 'forward'
-            group.edges.append(forward)
-            if block:
-                block.edges.append(forward)
-
-        if stmt.followers:
-            followers = list(stmt.followers)
-            next_edge_type, next_to_node = followers.pop(0)
-            nested = parser.Edge(stmt.to_node, next_edge_type, next_to_node,
-                                 followers, stmt.attrs, stmt.edge_block)
-            self.instantiate_edge(group, block, nested)
-        elif stmt.edge_block:
-            self.instantiate(group, block, stmt.edge_block)
-
-        if edge.dir in ('back', 'both'):
-            reverse = edge.duplicate()
-            reverse.dir = 'back'
-            if edge.dir == 'both':
-                reverse.style = 'dashed'
-                reverse.label = edge.return_label
-                reverse.leftnote = None
-                reverse.rightnote = None
-
-            group.edges.append(reverse)
-            if block:
-                block.edges.append(reverse)
+        """Instantiate the edge statement and its followers
+
+        The edge block and the return edges come after the edges of the
+        followers; they are returned as the items for the stack of
+        instantiate() (the last item should be processed first).
+        """
+        items = []
+        from_node_id = stmt.from_node
+        hops = [(stmt.edge_type, stmt.to_node)] + list(stmt.followers)
+        for edge_type, to_node_id in hops:
+            from_node = self.context.DiagramNode.get(from_node_id)
+            self.append_node(from_node, group)
+
+            to_node = self.context.DiagramNode.get(to_node_id)
+            self.append_node(to_node, group)
+
+            edge = self.context.DiagramEdge(from_node, to_node)
+            edge.set_dir(edge_type)
+            edge.set_attributes(stmt.attrs)
+
+            if edge.dir in ('forward', 'both'):
+                self.append_edge(group, edge, 'forward')
+
+            if edge.dir in ('back', 'both'):
+                items.append(partial(self.append_edge, group, edge, 'back'))
+
+            from_node_id = to_node_id
+
+        if stmt.edge_block:
+            items.append((group, block, iter(stmt.edge_block.stmts)))
+
+        return items
+
+    def append_edge(self, group, edge, direction):
+        copied = edge.duplicate()
+        copied.dir = direction
+        if direction == 'back' and edge.dir == 'both':
+            copied.style = 'dashed'
+            copied.label = edge.return_label
+            copied.leftnote = None
+            copied.rightnote = None
+
+        group.edges.append(copied)
+        self.rows.append(copied)
+
+
+def iter_statements(stmt):
+    """Iterate over the statement and its descendants in pre-order"""
+    stack = [stmt]
+    while stack:
+        stmt = stack.pop()
+        yield stmt
+
+        if isinstance(stmt, parser.Edge):
+            if stmt.edge_block:
+                stack.extend(reversed(stmt.edge_block.stmts))
+        elif isinstance(stmt, (parser.Group, parser.Fragment)):
+            stack.extend(reversed(stmt.stmts))
+
+
+def referenced_nodes(stmt):
+    """Returns the ids of the nodes referred by the statement"""
+    node_ids = []
+    for sub in iter_statements(stmt):
+        if isinstance(sub, parser.Node):
+            node_ids.append(unquote(sub.id))
+        elif isinstance(sub, parser.Edge):
+            node_ids.append(unquote(sub.from_node))
+            node_ids.append(unquote(sub.to_node))
+            node_ids.extend(unquote(node_id) for _, node_id in sub.followers)
+
+    return node_ids
+
+
+class IncrementalBuilder(DiagramTreeBuilder):
+    """Build a diagram, then apply edited parse trees to it
+
+    update() compares the top-level statements with the previous tree.  If
+    only edges, separators and fragments are changed and they refer to the
+    nodes appearing before the change, the elements of the other statements
+    are kept and the rows of the changed statements are replaced in place.
+    Otherwise the diagram is built from scratch.
+
+    update() returns the diagram and the range of rows to redraw.  If the
+    replaced rows differ only in colors and styles, they are the replaced
+    rows and the rows whose activations are changed.  If the sizes of the
+    rows may differ (labels, nodes or the number of rows are changed), the
+    rows below them move, so the range reaches the last row.  If notes or
+    fragments are changed, the margins and the spans of the page may
+    change, so all rows are in the range.
+
+    Only building is incremental: the orders of rows and the activations
+    are updated over the whole diagram, and DiagramMetrics and DiagramDraw
+    still lay out and draw all rows.
+    """
+    patchable = (parser.Edge, parser.Separator, parser.Fragment)
+
+    # attributes changing the look of rows and altblocks, not their sizes
+    paint_attributes = frozenset(['color', 'linecolor', 'textcolor',
+                                  'notecolor', 'style', 'hstyle', 'thick',
+                                  'asynchronous', 'failed', 'activate',
+                                  'description'])
+    # attributes set by DiagramMetrics
+    measured_attributes = frozenset(['textwidth', 'textheight',
+                                     'leftnotesize', 'rightnotesize'])
+
+    def __init__(self):
+        self.diagram = None
+
+    def build(self, tree):
+        if isinstance(tree, StatementTable):
+            tree = tree.to_tree()
+
+        self.context = BuildContext()
+        self.diagram = self.context.Diagram()
+        self.rows = []
+        self.altblocks = []
+        self.stmts = list(tree.stmts)
+        self.spans = []  # number of rows and altblocks of each statement
+        self.first_refs = {}  # node id -> index of the statement
+        for i, stmt in enumerate(self.stmts):
+            for node_id in referenced_nodes(stmt):
+                self.first_refs.setdefault(node_id, i)
+
+            self.spans.append(self.instantiate_statement(stmt))
+
+        self.layout()
+        return self.diagram
+
+    def update(self, tree):
+        if isinstance(tree, StatementTable):
+            tree = tree.to_tree()
+
+        stmts = list(tree.stmts)
+        if self.diagram is None:  # not built yet, or broken by patch()
+            self.build(parser.Diagram(tree.id, stmts))
+            return Update(self.diagram, range(0, len(self.rows)), True)
+
+        size = min(len(self.stmts), len(stmts))
+        head = 0
+        while head < size and self.stmts[head] == stmts[head]:
+            head += 1
+
+        tail = 0
+        while (tail < size - head and
+               self.stmts[-1 - tail] == stmts[-1 - tail]):
+            tail += 1
+
+        removed = self.stmts[head:len(self.stmts) - tail]
+        added = stmts[head:len(stmts) - tail]
+
+        if not self.is_patchable(head, removed + added):
+            self.build(parser.Diagram(tree.id, stmts))
+            return Update(self.diagram, range(0, len(self.rows)), True)
+
+        try:
+            dirty_rows = self.patch(head, len(removed), added)
+            self.stmts = stmts
+            # The changed statements refer only to the nodes referred
+            # before them, so the first references after the change are
+            # just shifted.
+            delta = len(added) - len(removed)
+            if delta:
+                for node_id, index in self.first_refs.items():
+                    if index >= head:
+                        self.first_refs[node_id] = index + delta
+        except Exception:
+            self.diagram = None  # broken; build it from scratch next time
+            raise
+
+        return Update(self.diagram, dirty_rows, False)
+
+    def is_patchable(self, head, stmts):
+        if self.diagram.autonumber:
+            return False  # the labels of all rows after the change
+
+        for stmt in stmts:
+            if not isinstance(stmt, self.patchable):
+                return False
+
+            for sub in iter_statements(stmt):
+                if isinstance(sub, parser.Node):
+                    return False  # node attributes
+
+            # the order of nodes is kept if they appear before the change
+            for node_id in referenced_nodes(stmt):
+                if self.first_refs.get(node_id, head) >= head:
+                    return False
+
+        return True
+
+    def instantiate_statement(self, stmt):
+        rows = len(self.rows)
+        altblocks = len(self.altblocks)
+        self.instantiate(self.diagram, None, parser.Statements([stmt]))
+
+        return (len(self.rows) - rows, len(self.altblocks) - altblocks)
+
+    def patch(self, head, count, stmts):
+        start = sum(rows for rows, _ in self.spans[:head])
+        end = start + sum(rows for rows, _ in self.spans[head:head + count])
+        first = sum(blocks for _, blocks in self.spans[:head])
+        last = first + sum(blocks for _, blocks in
+                           self.spans[head:head + count])
+
+        old_rows = self.rows[start:end]
+        old_altblocks = self.altblocks[first:last]
+        tail_rows = self.rows[end:]
+        tail_altblocks = self.altblocks[last:]
+        del self.rows[start:]
+        del self.altblocks[first:]
+
+        self.spans[head:head + count] = [self.instantiate_statement(stmt)
+                                         for stmt in stmts]
+        new_rows = self.rows[start:]
+        new_altblocks = self.altblocks[first:]
+        delta = len(self.rows) - end
+
+        self.rows += tail_rows
+        self.altblocks += tail_altblocks
+        if delta:
+            for altblock in tail_altblocks:
+                altblock.start += delta
+                altblock.end += delta
+                if altblock.top is not None:
+                    altblock.top += delta
+                    altblock.bottom += delta
+
+        self.diagram.edges[:] = [row for row in self.rows
+                                 if isinstance(row, DiagramEdge)]
+        self.diagram.separators[:] = [row for row in self.rows
+                                      if not isinstance(row, DiagramEdge)]
+        self.update_edge_order(start)
+        self.update_altblock_extent(new_altblocks)
+        self.update_altblock_ylevel()
+        self.diagram.colheight = len(self.rows) + 1
+
+        if old_altblocks or new_altblocks or \
+                any(row.leftnote or row.rightnote
+                    for row in old_rows + new_rows
+                    if isinstance(row, DiagramEdge)):
+            if self.layout_keys(old_rows + old_altblocks) == \
+                    self.layout_keys(new_rows + new_altblocks):
+                dirty_start, dirty_end = start, end
+            else:
+                dirty_start, dirty_end = 0, len(self.rows)
+        elif delta or self.layout_keys(old_rows) != \
+                self.layout_keys(new_rows):
+            dirty_start, dirty_end = start, len(self.rows)
+        else:
+            dirty_start, dirty_end = start, end
+
+        if self.diagram.activation != 'none':
+            activities = {}
+            for node in self.diagram.nodes:
+                activities[node] = node.activities
+                node.activity = []
+                node.activities = []
+
+            self.create_activities()
+
+            def intervals(activities):
+                return set((a['lifetime'].start, a['lifetime'].stop,
+                            a['level']) for a in activities)
+
+            for node in self.diagram.nodes:
+                changed = (intervals(activities[node]) ^
+                           intervals(node.activities))
+                for lifetime_start, lifetime_stop, _ in changed:
+                    dirty_start = min(dirty_start, lifetime_start)
+                    dirty_end = max(dirty_end, lifetime_stop)
+
+        # the removed activations may have ended below the last row
+        return range(dirty_start, min(dirty_end, len(self.rows)))
+
+    def layout_keys(self, elements):
+        """Returns the attributes of the elements affecting their sizes"""
+        ignored = self.paint_attributes | self.measured_attributes
+        keys = []
+        for element in elements:
+            attrs = [(name, value) for name, value in vars(element).items()
+                     if name not in ignored and name != 'rows']
+            keys.append((type(element).__name__, sorted(attrs)))
+
+        return keys
 
 
 class ScreenNodeBuilder(object):
     @classmethod
-    def build(cls, tree):
-        DiagramNode.clear()
-        DiagramEdge.clear()
-        NodeGroup.clear()
-
-        return DiagramTreeBuilder().build(tree)
+    def build(cls, tree, *, context=None):
+        return DiagramTreeBuilder(context).build(tree)
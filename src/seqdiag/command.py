@@ -13,19 +13,262 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import codecs
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
-from blockdiag.utils.bootstrap import Application
+from blockdiag import plugins
+from blockdiag.utils.bootstrap import Application, Options
+from blockdiag.utils.logging import error
 
 import seqdiag
 import seqdiag.builder
 import seqdiag.drawer
+import seqdiag.metrics
 import seqdiag.parser
+from seqdiag.rowlayout import get_backend
+from seqdiag.utils.diskcache import DiskCache
+from seqdiag.utils.profiling import PhaseStats, Profiler
+from seqdiag.utils.textcache import TextCache
+
+
+class SeqdiagOptions(Options):
+    def build_parser(self):
+        p = super(SeqdiagOptions, self).build_parser()
+        p.add_option('--parse-cache', metavar='DIR',
+                     help='cache parsed diagrams in DIR')
+        p.add_option('--text-cache', metavar='DIR',
+                     help='cache the sizes of measured texts in DIR')
+        p.add_option('--rowlayout', type='choice', metavar='BACKEND',
+                     choices=('python', 'numpy'),
+                     help='compute the layout of rows with BACKEND: python '
+                          '(default) or numpy (requires numpy)')
+        p.add_option('--check', action='store_true',
+                     help='only check that the diagrams in infiles are '
+                          'valid; do not render them')
+        p.add_option('-j', '--jobs', type='int',
+                     help='number of processes used by --check '
+                          '(default: number of CPUs)', metavar='N')
+        p.add_option('--stats', action='store_true',
+                     help='print the time and the growth of memory usage of '
+                          'each phase and statistics of the diagram to '
+                          'stderr')
+        p.add_option('--trace-memory', action='store_true',
+                     help='with --stats, trace the peak memory allocated in '
+                          'each phase (slows down the rendering)')
+        p.add_option('--profile', metavar='FILE',
+                     help='profile the rendering and write the stats of '
+                          'cProfile to FILE; if FILE ends with .folded, '
+                          'write sampled stacks for flame graphs instead')
+
+        return p
+
+    def validate(self):
+        if not self.options.check:
+            return super(SeqdiagOptions, self).validate()
+
+        if len(self.args) == 0:
+            self.parser.print_help()
+            sys.exit(0)
+
+        self.options.inputs = self.args
+        if self.options.jobs is not None and self.options.jobs < 1:
+            raise RuntimeError("--jobs option must be a positive number.")
 
 
 class SeqdiagApp(Application):
     module = seqdiag
 
+    def __init__(self):
+        super(SeqdiagApp, self).__init__()
+        self.stats = PhaseStats()
+        self.parse_cache = None
+
+    def run(self, args):
+        self.options = None
+        self.parse_cache = None
+        try:
+            self.parse_options(args)
+            if self.options.check:
+                return self.check_diagrams()
+        except SystemExit as e:
+            return e
+        except Exception as e:
+            error("%s" % e)
+            return -1
+
+        show_stats = self.options.stats
+        profiler = None
+        if self.options.profile:
+            profiler = Profiler(self.options.profile)
+            profiler.start()
+
+        self.stats = PhaseStats(trace_memory=show_stats and
+                                self.options.trace_memory)
+        try:
+            return super(SeqdiagApp, self).run(args)
+        finally:
+            if profiler:
+                profiler.stop()
+            if show_stats:
+                self.stats.report(sys.stderr)
+
+    def parse_options(self, args):
+        # run() parses the options before Application.run() calls this
+        if self.options is None:
+            self.options = SeqdiagOptions(self.module).parse(args)
+
+    def check_diagrams(self):
+        failed = False
+        for path, lineno, colno, message in \
+                check_diagrams(self.options.inputs, self.options.jobs,
+                               self.options.parse_cache):
+            message = ' '.join(message.splitlines())
+            sys.stdout.write("%s:%d:%d: %s\n" % (path, lineno, colno,
+                                                 message))
+            failed = True
+
+        sys.stdout.flush()
+        return 1 if failed else 0
+
+    def parse_diagram(self):
+        with self.stats.phase('parse'):
+            if not self.options.parse_cache:
+                return super(SeqdiagApp, self).parse_diagram()
+
+            if self.options.input == '-':
+                self.code = sys.stdin.read()
+                if self.code.startswith('\ufeff'):  # strip BOM
+                    self.code = self.code[1:]
+            else:
+                fp = codecs.open(self.options.input, 'r', 'utf-8-sig')
+                self.code = fp.read()
+
+            self.parse_cache = DiskCache(self.options.parse_cache)
+            parser = seqdiag.parser.Parser(cache=self.parse_cache)
+            return parser.parse_string(self.code)
+
+    def build_diagram(self, tree):
+        metrics = seqdiag.metrics.DiagramMetrics
+        default_rowlayout = metrics.rowlayout
+        if self.options.rowlayout:
+            metrics.rowlayout = get_backend(self.options.rowlayout)
+
+        try:
+            if not self.options.text_cache:
+                return self.render_diagram(tree)
+
+            textcache = TextCache(store=DiskCache(self.options.text_cache))
+            textcache.load()
+            default_textcache = metrics.textcache
+            metrics.textcache = textcache
+            try:
+                return self.render_diagram(tree)
+            finally:
+                metrics.textcache = default_textcache
+                textcache.save()
+        finally:
+            metrics.rowlayout = default_rowlayout
+
+    def render_diagram(self, tree):
+        stats = self.stats
+        textcache = self.module.metrics.DiagramMetrics.textcache
+        if textcache is not None:
+            cached = textcache.stats()
+
+        with stats.phase('build'):
+            ScreenNodeBuilder = self.module.builder.ScreenNodeBuilder
+            diagram = ScreenNodeBuilder.build(tree)
+
+        with stats.phase('metrics'):
+            DiagramDraw = self.module.drawer.DiagramDraw
+            drawer = DiagramDraw(self.options.type, diagram,
+                                 self.options.output, fontmap=self.fontmap,
+                                 code=self.code,
+                                 antialias=self.options.antialias,
+                                 nodoctype=self.options.nodoctype,
+                                 transparency=self.options.transparency)
+
+        with stats.phase('draw'):
+            drawer.draw()
+
+        with stats.phase('save'):
+            if self.options.size:
+                drawer.save(size=self.options.size)
+            else:
+                drawer.save()
+
+        stats.count('participants', len(diagram.nodes))
+        stats.count('edges', len(diagram.edges))
+        stats.count('separators', len(diagram.separators))
+        stats.count('altblocks', len(diagram.altblocks))
+        stats.count('canvas', '%dx%d' % tuple(drawer.pagesize()))
+        if textcache is not None:
+            hits = textcache.hits - cached['hits']
+            misses = textcache.misses - cached['misses']
+            stats.count('text measurements', misses)
+            stats.count('text cache hits', hit_rate(hits, misses))
+
+        if self.parse_cache is None:
+            stats.count('parse cache', 'disabled')
+        else:
+            stats.count('parse cache hits',
+                        hit_rate(self.parse_cache.hits,
+                                 self.parse_cache.misses))
+
+        return 0
+
+
+def hit_rate(hits, misses):
+    if hits + misses:
+        return '%d/%d (%.1f%%)' % (hits, hits + misses,
+                                   hits * 100.0 / (hits + misses))
+    else:
+        return '0/0'
+
+
+def check_diagram(path, parse_cache=None):
+    """Parse and build the diagram without rendering it
+
+    Returns a list of diagnostics; each is a tuple of (path, line, column,
+    message).  Line and column are 0 when the position is not known.
+    """
+    if parse_cache:
+        parser = seqdiag.parser.Parser(cache=DiskCache(parse_cache))
+    else:
+        parser = seqdiag.parser.default_parser
+
+    try:
+        tree = parser.parse_file(path)
+        seqdiag.builder.ScreenNodeBuilder.build(tree)
+    except seqdiag.parser.ParseException as exc:
+        return [(path, exc.lineno or 0, exc.colno or 0, str(exc))]
+    except Exception as exc:
+        return [(path, 0, 0, str(exc))]
+    finally:
+        plugins.cleanup()
+
+    return []
+
+
+def check_diagrams(paths, jobs=None, parse_cache=None):
+    """Check the diagrams in a pool of processes; yields diagnostics"""
+    check = partial(check_diagram, parse_cache=parse_cache)
+    jobs = min(jobs or os.cpu_count() or 1, len(paths))
+    if jobs <= 1:
+        for path in paths:
+            for diagnostic in check(path):
+                yield diagnostic
+    else:
+        chunksize = max(1, len(paths) // (jobs * 4))
+        with ProcessPoolExecutor(jobs) as executor:
+            for diagnostics in executor.map(check, paths,
+                                            chunksize=chunksize):
+                for diagnostic in diagnostics:
+                    yield diagnostic
+
 
 def main(args=sys.argv[1:]):
     return SeqdiagApp().run(args)
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from array import array
+
+from seqdiag import parser
+
+# kinds of statements
+NODE = 0
+ATTR = 1
+EDGE = 2
+EDGE_WITH_BLOCK = 3
+GROUP = 4
+SEPARATOR = 5
+EXTENSION = 6
+FRAGMENT = 7
+
+NONE = -1  # index for None
+
+
+class StatementTable(object):
+    """A compact, array-backed form of the parse tree
+
+    Each statement is a row of the table; rows are stored in pre-order and
+    ends[i] is the index next to the last descendant of the row i.  Strings
+    (identifiers, attribute names and values) are interned and referred by
+    index.  Options of the statements and followers of the edges are stored
+    in separate arrays; the range of row i is [X_end[i - 1], X_end[i]).
+
+    to_tree() converts it back to a parse tree; the statements are created
+    one top-level statement at a time while DiagramTreeBuilder consumes it.
+    """
+
+    def __init__(self, diagram_id=None):
+        self.id = diagram_id
+        self.strings = []
+        self.string_index = {}
+
+        self.kinds = array('b')
+        self.fields = (array('i'), array('i'), array('i'))
+        self.ends = array('i')
+        self.attr_names = array('i')
+        self.attr_values = array('i')
+        self.attr_ends = array('i')
+        self.follower_types = array('i')
+        self.follower_nodes = array('i')
+        self.follower_ends = array('i')
+
+    @classmethod
+    def from_tree(cls, tree):
+        """Build a table from a parse tree (or the result of iterparse)"""
+        table = cls(tree.id)
+        for stmt in tree.stmts:
+            table.append(stmt)
+
+        return table
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def intern(self, string):
+        if string is None:
+            return NONE
+
+        index = self.string_index.get(string)
+        if index is None:
+            index = self.string_index[string] = len(self.strings)
+            self.strings.append(string)
+
+        return index
+
+    def append(self, stmt):
+        """Append a top-level statement (and its descendants)"""
+        stack = [(None, iter([stmt]))]
+        while stack:
+            row, children = stack[-1]
+            stmt = next(children, None)
+            if stmt is None:
+                stack.pop()
+                if row is not None:
+                    self.ends[row] = len(self.kinds)
+                continue
+
+            row = len(self.kinds)
+            if isinstance(stmt, parser.Node):
+                self.add_row(NODE, stmt.id, attrs=stmt.attrs)
+            elif isinstance(stmt, parser.Attr):
+                self.add_row(ATTR, stmt.name, stmt.value)
+            elif isinstance(stmt, parser.Edge):
+                if stmt.edge_block is None:
+                    kind = EDGE
+                else:
+                    kind = EDGE_WITH_BLOCK
+                    stack.append((row, iter(stmt.edge_block.stmts)))
+                self.add_row(kind, stmt.from_node, stmt.edge_type,
+                             stmt.to_node, stmt.attrs, stmt.followers)
+            elif isinstance(stmt, parser.Group):
+                self.add_row(GROUP)
+                stack.append((row, iter(stmt.stmts)))
+            elif isinstance(stmt, parser.Separator):
+                self.add_row(SEPARATOR, stmt.type, stmt.value)
+            elif isinstance(stmt, parser.Extension):
+                self.add_row(EXTENSION, stmt.type, stmt.name, attrs=stmt.attrs)
+            elif isinstance(stmt, parser.Fragment):
+                self.add_row(FRAGMENT, stmt.type, stmt.id)
+                stack.append((row, iter(stmt.stmts)))
+            else:
+                raise TypeError("unknown statement: %r" % (stmt,))
+
+    def add_row(self, kind, a=None, b=None, c=None, attrs=(), followers=()):
+        row = len(self.kinds)
+        self.kinds.append(kind)
+        for field, value in zip(self.fields, (a, b, c)):
+            field.append(self.intern(value))
+        self.ends.append(row + 1)
+
+        for attr in attrs:
+            self.attr_names.append(self.intern(attr.name))
+            self.attr_values.append(self.intern(attr.value))
+        self.attr_ends.append(len(self.attr_names))
+
+        for edge_type, node_id in followers:
+            self.follower_types.append(self.intern(edge_type))
+            self.follower_nodes.append(self.intern(node_id))
+        self.follower_ends.append(len(self.follower_types))
+
+    def string(self, index):
+        if index == NONE:
+            return None
+        else:
+            return self.strings[index]
+
+    def attrs(self, row):
+        start = self.attr_ends[row - 1] if row else 0
+        return [parser.Attr(self.string(self.attr_names[i]),
+                            self.string(self.attr_values[i]))
+                for i in range(start, self.attr_ends[row])]
+
+    def followers(self, row):
+        start = self.follower_ends[row - 1] if row else 0
+        return [(self.string(self.follower_types[i]),
+                 self.string(self.follower_nodes[i]))
+                for i in range(start, self.follower_ends[row])]
+
+    def statement(self, row):
+        """Create a statement of the row (and its descendants)"""
+        root = []
+        stack = [(root, self.ends[row])]
+        for i in range(row, self.ends[row]):
+            while stack[-1][1] <= i:
+                stack.pop()
+
+            kind = self.kinds[i]
+            a, b, c = (self.string(field[i]) for field in self.fields)
+            children = []
+            if kind == NODE:
+                stmt = parser.Node(a, self.attrs(i))
+            elif kind == ATTR:
+                stmt = parser.Attr(a, b)
+            elif kind in (EDGE, EDGE_WITH_BLOCK):
+                if kind == EDGE:
+                    edge_block = None
+                else:
+                    edge_block = parser.Statements(children)
+                stmt = parser.Edge(a, b, c, self.followers(i), self.attrs(i),
+                                   edge_block)
+            elif kind == GROUP:
+                stmt = parser.Group(children)
+            elif kind == SEPARATOR:
+                stmt = parser.Separator(a, b)
+            elif kind == EXTENSION:
+                stmt = parser.Extension(a, b, self.attrs(i))
+            else:  # FRAGMENT
+                stmt = parser.Fragment(a, b, children)
+
+            stack[-1][0].append(stmt)
+            if self.ends[i] > i + 1:
+                stack.append((children, self.ends[i]))
+
+        return root[0]
+
+    def iter_statements(self):
+        """Iterate over the top-level statements"""
+        row = 0
+        while row < len(self.kinds):
+            yield self.statement(row)
+            row = self.ends[row]
+
+    def to_tree(self):
+        return parser.Diagram(self.id, self.iter_statements())
@@ -77,7 +77,7 @@ class DiagramDraw(blockdiag.drawer.DiagramDraw):
         dx, dy = m.shadow_offset
 
         if edge.leftnote:
-            polygon = m.edge(edge).leftnoteshape
+            polygon = m.edge_layout(edge).leftnoteshape
             shadow = [XY(pt.x + dx, pt.y + dy) for pt in polygon]
             if self.diagram.shadow_style == 'solid':
                 self.drawer.polygon(shadow, fill=self.shadow,
@@ -87,7 +87,7 @@ class DiagramDraw(blockdiag.drawer.DiagramDraw):
                                     outline=self.shadow, filter='transp-blur')
 
         if edge.rightnote:
-            polygon = m.edge(edge).rightnoteshape
+            polygon = m.edge_layout(edge).rightnoteshape
             shadow = [XY(pt.x + dx, pt.y + dy) for pt in polygon]
             if self.diagram.shadow_style == 'solid':
                 self.drawer.polygon(shadow, fill=self.shadow,
@@ -98,7 +98,7 @@ class DiagramDraw(blockdiag.drawer.DiagramDraw):
 
     def edge(self, edge):
         # render shaft of edges
-        m = self.metrics.edge(edge)
+        m = self.metrics.edge_layout(edge)
         shaft = m.shaft
         self.drawer.line(shaft, fill=edge.color, style=edge.style)
 
@@ -139,7 +139,7 @@ class DiagramDraw(blockdiag.drawer.DiagramDraw):
                                  fill=edge.color, halign='left')
 
     def edge_label(self, edge):
-        m = self.metrics.edge(edge)
+        m = self.metrics.edge_layout(edge)
 
         if edge.label:
             if edge.direction in ('right', 'self'):
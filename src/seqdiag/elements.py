@@ -13,35 +13,208 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+from bisect import bisect_right
+from heapq import heappop, heappush
+
 import blockdiag.elements
-from blockdiag.utils import XY, Size, images
+from blockdiag import noderenderer, plugins
+from blockdiag.utils import XY, Size, images, unquote
 from blockdiag.utils.logging import warning
 
 
-class NodeGroup(blockdiag.elements.NodeGroup):
-    pass
+class BuildContext(object):
+    """Element classes and registries for building a diagram
+
+    The context has its own subclasses of the element classes.  Default
+    values set through the set_default_*() classmethods, the elements
+    registered by get() and the class statements belong to the context, so
+    diagrams can be built and drawn concurrently in separate contexts.
+
+    Plugins are still loaded into the process-wide ``blockdiag.plugins``.
+    """
+
+    def __init__(self):
+        self.classes = {}
+        self.DiagramNode = self.subclass(DiagramNode)
+        self.DiagramEdge = self.subclass(DiagramEdge)
+        self.NodeGroup = self.subclass(NodeGroup)
+        self.EdgeSeparator = self.subclass(EdgeSeparator)
+        self.AltBlock = self.subclass(AltBlock)
+        self.Diagram = self.subclass(Diagram,
+                                     _DiagramNode=self.DiagramNode,
+                                     _DiagramEdge=self.DiagramEdge,
+                                     _NodeGroup=self.NodeGroup,
+                                     _EdgeSeparator=self.EdgeSeparator,
+                                     _AltBlock=self.AltBlock)
+        self.Diagram.classes = self.classes
+
+    def subclass(self, klass, **attrs):
+        attrs['context'] = self
+        subclass = type(klass.__name__, (klass,), attrs)
+        subclass.clear()
+        return subclass
+
+
+class ContextMixin(object):
+    """Look up class statements in the build context of the element"""
+    context = None
+
+    def set_attribute(self, attr):
+        if attr.name == 'class' and self.context:
+            self.set_class(attr.value)
+        else:
+            super(ContextMixin, self).set_attribute(attr)
+
+    def set_class(self, value):
+        value = unquote(value)
+        if value in self.context.classes:
+            klass = self.context.classes[value]
+            self.set_attributes(klass.attrs)
+        else:
+            msg = "Unknown class: %s" % value
+            raise AttributeError(msg)
+
+
+class NodeList(list):
+    """A list of nodes with O(1) membership test
+
+    It keeps the order of the nodes like a list (and supports all of its
+    operations), and counts the nodes in a dict for ``node in nodes``.
+    """
+
+    def __init__(self, iterable=()):
+        super(NodeList, self).__init__()
+        self._counts = {}
+        self.extend(iterable)
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+    def _add(self, items):
+        for item in items:
+            self._counts[item] = self._counts.get(item, 0) + 1
+
+    def _discard(self, items):
+        for item in items:
+            count = self._counts.pop(item) - 1
+            if count:
+                self._counts[item] = count
+
+    def __contains__(self, item):
+        try:
+            return item in self._counts
+        except TypeError:  # unhashable
+            return super(NodeList, self).__contains__(item)
+
+    def append(self, item):
+        super(NodeList, self).append(item)
+        self._add([item])
+
+    def extend(self, iterable):
+        items = list(iterable)
+        super(NodeList, self).extend(items)
+        self._add(items)
+
+    def __iadd__(self, iterable):
+        self.extend(iterable)
+        return self
+
+    def __imul__(self, n):
+        items = list(self)
+        super(NodeList, self).__imul__(n)
+        self._add(items * (max(n, 1) - 1))
+        if n <= 0:
+            self._counts = {}
+        return self
+
+    def insert(self, index, item):
+        super(NodeList, self).insert(index, item)
+        self._add([item])
+
+    def remove(self, item):
+        super(NodeList, self).remove(item)
+        self._discard([item])
+
+    def pop(self, index=-1):
+        item = super(NodeList, self).pop(index)
+        self._discard([item])
+        return item
+
+    def clear(self):
+        super(NodeList, self).clear()
+        self._counts = {}
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = list(value)
+            removed = self[index]
+            added = value
+        else:
+            removed = [self[index]]
+            added = [value]
+
+        super(NodeList, self).__setitem__(index, value)
+        self._discard(removed)
+        self._add(added)
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            removed = self[index]
+        else:
+            removed = [self[index]]
+
+        super(NodeList, self).__delitem__(index)
+        self._discard(removed)
+
+
+class NodeGroup(ContextMixin, blockdiag.elements.NodeGroup):
+    def __init__(self, elemid):
+        super(NodeGroup, self).__init__(elemid)
+        self.nodes = NodeList()
+
+    def duplicate(self):
+        copied = super(NodeGroup, self).duplicate()
+        copied.nodes = NodeList()
+
+        return copied
 
 
-class DiagramNode(blockdiag.elements.DiagramNode):
+class DiagramNode(ContextMixin, blockdiag.elements.DiagramNode):
     def __init__(self, _id):
         super(DiagramNode, self).__init__(_id)
 
         self.activated = False
-        self.activity = []
+        self.activity = []  # the last [start, end] rows of each level
         self.activities = []
+        self.activity_rows = []  # index of activities; see activity_level()
+        self.activity_levels = []
+
+    def set_attribute(self, attr):
+        if attr.name == 'class' and self.context:
+            # fire events for the class attribute as blockdiag does
+            if plugins.fire_node_event(self, 'attr_changing', attr):
+                self.set_class(attr.value)
+                plugins.fire_node_event(self, 'attr_changed', attr)
+        else:
+            super(DiagramNode, self).set_attribute(attr)
 
     def set_activated(self, value):
         self.activated = True
 
-    def activate(self, height, index):
-        if len(self.activity) <= index:
-            self.activity.insert(index, [])
+    def activate(self, height, index, end=None):
+        """Mark rows from height to end (default: height) active at index"""
+        if end is None:
+            end = height
 
-        if (len(self.activity[index]) > 0 and
-           (self.activity[index][-1] != height - 1)):
-            self.deactivate(index)
+        while len(self.activity) <= index:
+            self.activity.append(None)
 
-        self.activity[index].append(height)
+        current = self.activity[index]
+        if current and current[1] == height - 1:
+            current[1] = end
+        else:
+            self.deactivate(index)
+            self.activity[index] = [height, end]
 
     def deactivate(self, index=None):
         if index is None:
@@ -49,15 +222,53 @@ class DiagramNode(blockdiag.elements.DiagramNode):
                 self.deactivate(i)
             return
 
-        if self.activity[index]:
-            attr = {'lifetime': self.activity[index],
+        if index < len(self.activity) and self.activity[index]:
+            start, end = self.activity[index]
+            attr = {'lifetime': range(start, end + 1),
                     'level': index}
             self.activities.append(attr)
-
-        self.activity[index] = []
+            self.activity[index] = None
+
+    def index_activities(self):
+        """Index the deepest level of activities by row
+
+        The level is a step function of the row; activity_rows holds the
+        rows where it changes and activity_levels the level from there.
+        """
+        self.activity_rows = []
+        self.activity_levels = []
+
+        activities = sorted(self.activities,
+                            key=lambda a: a['lifetime'].start)
+        rows = sorted(set(a['lifetime'].start for a in activities) |
+                      set(a['lifetime'].stop for a in activities))
+        active = []  # heap of (-level, stop) of activities
+        i = 0
+        for row in rows:
+            while i < len(activities) and \
+                    activities[i]['lifetime'].start <= row:
+                lifetime = activities[i]['lifetime']
+                heappush(active, (-activities[i]['level'], lifetime.stop))
+                i += 1
+
+            while active and active[0][1] <= row:
+                heappop(active)  # ended
+
+            level = -active[0][0] if active else 0
+            if not self.activity_levels or self.activity_levels[-1] != level:
+                self.activity_rows.append(row)
+                self.activity_levels.append(level)
+
+    def activity_level(self, row):
+        """Returns the deepest level of activities at the row (or 0)"""
+        i = bisect_right(self.activity_rows, row) - 1
+        if i < 0:
+            return 0
+        else:
+            return self.activity_levels[i]
 
 
-class EdgeSeparator(blockdiag.elements.Base):
+class EdgeSeparator(ContextMixin, blockdiag.elements.Base):
     basecolor = (208, 208, 208)
     linecolor = (0, 0, 0)
 
@@ -81,7 +292,7 @@ class EdgeSeparator(blockdiag.elements.Base):
             self.type = 'delay'
 
 
-class DiagramEdge(blockdiag.elements.DiagramEdge):
+class DiagramEdge(ContextMixin, blockdiag.elements.DiagramEdge):
     notecolor = (255, 182, 193)  # LightPink
     label_margin = 2
 
@@ -210,7 +421,7 @@ class DiagramEdge(blockdiag.elements.DiagramEdge):
                 return [label, self.description]
 
 
-class AltBlock(blockdiag.elements.Base):
+class AltBlock(ContextMixin, blockdiag.elements.Base):
     basecolor = (0, 0, 0)
     linecolor = (0, 0, 0)
     width = None
@@ -218,7 +429,7 @@ class AltBlock(blockdiag.elements.Base):
 
     @classmethod
     def clear(cls):
-        super(EdgeSeparator, cls).clear()
+        super(AltBlock, cls).clear()
         cls.basecolor = (0, 0, 0)
         cls.linecolor = (0, 0, 0)
 
@@ -233,44 +444,60 @@ class AltBlock(blockdiag.elements.Base):
         self.xlevel = 1
         self.ylevel_top = 1
         self.ylevel_bottom = 1
-        self.edges = []
         self.color = self.basecolor
 
+        # the block covers rows[start:end] (edges and separators of the
+        # diagram); its edges are drawn from row top to bottom and from
+        # column left to right
+        self.rows = []
+        self.start = 0
+        self.end = 0
+        self.top = None
+        self.bottom = None
+        self.left = None
+        self.right = None
+
+    @property
+    def edges(self):
+        return [row for row in self.rows[self.start:self.end]
+                if not isinstance(row, EdgeSeparator)]
+
     @property
     def xy(self):
-        if len(self.edges) == 0:
+        if self.top is None:
             return XY(0, 0)
         else:
-            x = min(e.left_node.xy.x for e in self.edges)
-            y = min(e.order for e in self.edges) + 1
-            return XY(x, y)
+            return XY(self.left, self.top + 1)
 
     @property
     def colwidth(self):
-        if len(self.edges) == 0:
+        if self.top is None:
             return 1
         else:
-            x2 = max(e.right_node.xy.x for e in self.edges)
-            return x2 - self.xy.x + 1
+            return self.right - self.left + 1
 
     @property
     def colheight(self):
-        if len(self.edges) == 0:
+        if self.top is None:
             return 1
         else:
-            y2 = max(e.order for e in self.edges) + 1
-            return y2 - self.xy.y + 1
+            return self.bottom - self.top + 1
 
 
-class Diagram(blockdiag.elements.Diagram):
+class Diagram(ContextMixin, blockdiag.elements.Diagram):
     _DiagramNode = DiagramNode
     _DiagramEdge = DiagramEdge
+    _NodeGroup = NodeGroup
+    _EdgeSeparator = EdgeSeparator
+    _AltBlock = AltBlock
 
     def __init__(self):
         super(Diagram, self).__init__()
 
         self.int_attrs.append('edge_length')
 
+        self.nodes = NodeList()
+
         self.activation = True
         self.autonumber = False
         self.edge_length = None
@@ -284,13 +511,13 @@ class Diagram(blockdiag.elements.Diagram):
     def set_default_textcolor(self, color):
         super(Diagram, self).set_default_textcolor(color)
 
-        EdgeSeparator.set_default_text_color(color)
+        self._EdgeSeparator.set_default_text_color(color)
 
     def set_default_linecolor(self, color):
         super(Diagram, self).set_default_linecolor(color)
 
         color = images.color_to_rgb(color)
-        AltBlock.set_default_linecolor(color)
+        self._AltBlock.set_default_linecolor(color)
 
     def set_default_note_color(self, color):
         color = images.color_to_rgb(color)
@@ -301,11 +528,28 @@ class Diagram(blockdiag.elements.Diagram):
 
     def set_default_fontfamily(self, fontfamily):
         super(Diagram, self).set_default_fontfamily(fontfamily)
-        EdgeSeparator.set_default_fontfamily(fontfamily)
+        self._EdgeSeparator.set_default_fontfamily(fontfamily)
+        self.fontfamily = fontfamily
 
     def set_default_fontsize(self, fontsize):
         super(Diagram, self).set_default_fontsize(fontsize)
-        EdgeSeparator.set_default_fontsize(fontsize)
+        self._EdgeSeparator.set_default_fontsize(fontsize)
+        self.fontsize = int(fontsize)
+
+    def set_default_shape(self, value):
+        if noderenderer.get(value):
+            self._DiagramNode.set_default_shape(value)
+        else:
+            msg = "unknown node shape: %s" % value
+            raise AttributeError(msg)
+
+    def set_default_label_orientation(self, value):
+        value = value.lower()
+        if value in ('horizontal', 'vertical'):
+            self._DiagramNode.label_orientation = value
+        else:
+            msg = "unknown label orientation: %s" % value
+            raise AttributeError(msg)
 
     def set_activation(self, value):
         value = value.lower()
@@ -22,10 +22,19 @@ from blockdiag.utils import XY, Box
 from blockdiag.utils.logging import warning
 
 from seqdiag import elements
+from seqdiag.rowlayout import get_backend
+from seqdiag.utils.textcache import default_cache
+
+# geometry of an edge; see DiagramMetrics.edge_layout()
+EdgeLayout = namedtuple('EdgeLayout', 'shaft head failedmark textbox '
+                                      'leftnotebox leftnoteshape '
+                                      'rightnotebox rightnoteshape')
 
 
 class DiagramMetrics(blockdiag.metrics.DiagramMetrics):
     edge_height = 10
+    textcache = default_cache  # set None to measure texts each time
+    rowlayout = get_backend()  # python; see seqdiag.rowlayout
 
     def __init__(self, diagram, **kwargs):
         super(DiagramMetrics, self).__init__(diagram, **kwargs)
@@ -45,6 +54,17 @@ class DiagramMetrics(blockdiag.metrics.DiagramMetrics):
             self.spreadsheet.set_span_width(self.node_count, self.span_width)
             self.span_width = span_width
 
+        # The left margin is widened as soon as a left note needs it; the
+        # following self-edges of the first node are measured with it.  The
+        # right margin is collected and widened once after all edges.  The
+        # heights of the rows are computed at once by the backend; the rows
+        # after the first right note are not lower than the default height
+        # (they have been filled with it by pagesize() of the spreadsheet).
+        heights = []
+        leftnotes = []
+        rightnotes = []
+        right_margin = None
+        start = len(diagram.edges)
         for edge in diagram.edges:
             edge.textwidth, edge.textheight = self.edge_textsize(edge)
 
@@ -53,62 +73,131 @@ class DiagramMetrics(blockdiag.metrics.DiagramMetrics):
                 height += self.node_height * 3 // 4
             elif edge.direction == 'self':
                 height += self.cellsize * 2
+            heights.append(height)
 
             font = self.font_for(edge)
             if edge.leftnote:
                 edge.leftnotesize = self.textsize(edge.leftnote, font=font)
-                if height < edge.leftnotesize.height:
-                    height = edge.leftnotesize.height
+                self.expand_left_margin_for_note(edge)
+            leftnotes.append(edge.leftnotesize.height)
 
             if edge.rightnote:
                 edge.rightnotesize = self.textsize(edge.rightnote, font=font)
-                if height < edge.rightnotesize.height:
-                    height = edge.rightnotesize.height
+                if right_margin is None:
+                    right_margin = self.spreadsheet.span_width[self.node_count]
+                    start = len(rightnotes) + 1
+
+                right_margin = max(right_margin,
+                                   self.right_margin_for_note(edge))
+            rightnotes.append(edge.rightnotesize.height)
 
+        heights = self.rowlayout.edge_heights(heights, leftnotes, rightnotes,
+                                              self.node_height, start)
+        for edge, height in zip(diagram.edges, heights):
             self.spreadsheet.set_node_height(edge.order + 1, height)
-            self.expand_pagesize_for_note(edge)
 
-        span_width = defaultdict(int)
-        span_height = defaultdict(int)
+        if right_margin is not None:
+            self.spreadsheet.set_span_width(self.node_count, right_margin)
+
+        # the span at column x is widened by the maximum number of block
+        # borders stacked on a row; count them by sweeping over the rows
+        # where the borders start (+1) and end (-1)
+        borders = defaultdict(list)
         for block in diagram.altblocks:
             x1, y1 = block.xy
             x2 = x1 + block.colwidth
             y2 = y1 + block.colheight
-
-            for y in range(y1, y2):
-                span_width[(x1, y)] += 1
-                span_width[(x2, y)] += 1
-
-            for x in range(x1, x2):
-                if block.type != 'else':
-                    span_height[(x, y1)] += 1
-                span_height[(x, y2)] += 1
-
-        for x in range(self.node_count + 1):
-            widths = [span_width[xy] for xy in span_width if xy[0] == x]
-            if widths:
-                width = self.span_width + max(widths) * self.cellsize
+            if y1 < y2:
+                for x in (x1, x2):
+                    borders[x].append((y1, 1))
+                    borders[x].append((y2, -1))
+
+        for x, steps in borders.items():
+            if 0 <= x <= self.node_count:
+                depth = max_depth = 0
+                for _, step in sorted(steps):
+                    depth += step
+                    max_depth = max(depth, max_depth)
+
+                width = self.span_width + max_depth * self.cellsize
                 self.spreadsheet.set_span_width(x, width)
 
-        for y in range(0, len(self.edges) + 1):
-            blocks = [b for b in diagram.altblocks if b.edges[0].order == y]
-            span_height = self.spreadsheet.span_height[y]
-            span_height = 0
+        tops = [(b.top, b.ylevel_top) for b in diagram.altblocks]
+        bottoms = [(b.bottom, b.ylevel_bottom) for b in diagram.altblocks]
+        spans = self.rowlayout.block_spans(len(self.edges), tops, bottoms,
+                                           self.cellsize)
+        for y, delta in sorted(spans.items()):
+            span_height = self.spreadsheet.span_height[y] + delta
+            self.spreadsheet.set_span_height(y, span_height)
+
+        self.build_rows()
+
+    def build_rows(self):
+        """Precompute the vertical extents of the rows
+
+        Each edge and separator takes the spreadsheet row of its order + 1
+        in column 1.  Their tops and bottoms are summed up once here
+        (relative to the page margin and padding), so cell(),
+        row_baseheight() and activity_box() are lookups.  Call it again
+        after changing the spreadsheet.
+        """
+        sheet = self.spreadsheet
+        self.rows = [None] * (len(self.edges) + len(self.separators))
+        for row in self.edges + self.separators:
+            self.rows[row.order] = row
+
+        left = (sheet.node_width.get(0, self.node_width) +
+                sheet.span_width.get(0, self.span_width) +
+                sheet.span_width.get(1, self.span_width))
+        self.row_x = (left, left + sheet.node_width.get(1, self.node_width))
+
+        rows = range(len(self.rows) + 1)
+        node_heights = [sheet.node_height.get(y, self.node_height)
+                        for y in rows]
+        span_heights = [sheet.span_height.get(y, self.span_height)
+                        for y in rows]
+        self.row_tops, self.row_bottoms = \
+            self.rowlayout.offsets(node_heights, span_heights)
+
+        self.edge_layouts = None
+        self.lifelines = None
+
+    def row_cell(self, order):
+        """Returns the cell of the row (an edge or a separator)"""
+        x1, x2 = self.row_x
+        dx = self.page_margin.x + self.page_padding[3]
+        dy = self.page_margin.y + self.page_padding[0]
+        return blockdiag.metrics.NodeMetrics(self, x1 + dx,
+                                             self.row_tops[order + 1] + dy,
+                                             x2 + dx,
+                                             self.row_bottoms[order + 1] + dy)
+
+    def row_baseheight(self, order):
+        """Returns the y coordinate of the baseline of the row"""
+        dy = self.page_margin.y + self.page_padding[0]
+        y1 = self.row_tops[order + 1] + dy
+        row = self.rows[order]
+        if isinstance(row, elements.EdgeSeparator):
+            return y1
+
+        height = self.row_bottoms[order + 1] + dy - y1
+        if (height == row.leftnotesize.height or
+                height == row.rightnotesize.height):
+            return y1 + height // 2
+        else:
+            return y1 + row.textheight
 
-            if blocks:
-                max_ylevel_top = max(b.ylevel_top for b in blocks)
-                span_height = (self.spreadsheet.span_height[y + 1] +
-                               self.cellsize * 5 // 2 * (max_ylevel_top - 1) +
-                               self.cellsize)
-                self.spreadsheet.set_span_height(y + 1, span_height)
+    def shift(self, x, y):
+        metrics = super(DiagramMetrics, self).shift(x, y)
+        metrics.edge_layouts = None  # computed with the previous margin
+        metrics.lifelines = None
+        return metrics
 
-            blocks = [b for b in diagram.altblocks if b.edges[-1].order == y]
-            if blocks:
-                max_ylevel_bottom = max(b.ylevel_bottom for b in blocks)
-                span_height = (self.spreadsheet.span_height[y + 2] +
-                               self.cellsize // 2 * (max_ylevel_bottom - 1))
+    def textsize(self, string, font=None, width=65535):
+        if self.textcache is None:
+            return super(DiagramMetrics, self).textsize(string, font, width)
 
-                self.spreadsheet.set_span_height(y + 2, span_height)
+        return self.textcache.textsize(self.drawer, string, font, width)
 
     def pagesize(self, width=None, height=None):
         width = self.node_count
@@ -117,10 +206,8 @@ class DiagramMetrics(blockdiag.metrics.DiagramMetrics):
 
     @property
     def bottomheight(self):
-        height = len(self.edges) + len(self.separators)
-        dummy = elements.DiagramNode(None)
-        dummy.xy = XY(1, height)
-        _, y = self.spreadsheet._node_bottomright(dummy, use_padding=False)
+        y = (self.page_margin.y + self.page_padding[0] +
+             self.row_bottoms[len(self.rows)])
         y += self.spreadsheet.span_height[len(self.edges) + 1] // 2
         return y
 
@@ -128,44 +215,54 @@ class DiagramMetrics(blockdiag.metrics.DiagramMetrics):
     def edge_length(self):
         return self.node_width + self.span_width
 
-    def lifeline(self, node):
-        delayed = []
-        for sep in self.separators:
-            if sep.type == 'delay':
-                delayed.append(sep)
+    def lifeline_segments(self):
+        """Returns the segments of lifelines as a list of (y1, y2, style)
+
+        The segments are shared by all nodes; they are computed once.  y1 of
+        the first segment is None; the lifeline starts at the bottom of each
+        node.
+        """
+        if self.lifelines is None:
+            d = self.cellsize
+            y = None
+            self.lifelines = []
+            for sep in self.separators:
+                if sep.type == 'delay':
+                    m = self.cell(sep)
+                    y1 = m.top.y
+                    y2 = m.bottom.y
+                    self.lifelines.append((y, y1, '8,4'))
+                    self.lifelines.append((y1 + d, y2 - d, '2,8'))
+                    y = y2
+
+            y2 = self.bottomheight + self.cellsize * 4
+            self.lifelines.append((y, y2, '8,4'))
+
+        return self.lifelines
 
+    def lifeline(self, node):
+        x, top = self.node(node).bottom
         lines = []
-        d = self.cellsize
-        pt = self.node(node).bottom
-        for sep in delayed:
-            m = self.cell(sep)
-            y1 = m.top.y
-            y2 = m.bottom.y
-            lines.append(((pt, XY(pt.x, y1)), '8,4'))
-            lines.append(((XY(pt.x, y1 + d), XY(pt.x, y2 - d)), '2,8'))
-
-            pt = XY(pt.x, y2)
-
-        y = self.bottomheight + self.cellsize * 4
-        lines.append(((pt, XY(pt.x, y)), '8,4'))
+        for y1, y2, style in self.lifeline_segments():
+            if y1 is None:
+                y1 = top
+            lines.append(((XY(x, y1), XY(x, y2)), style))
 
         return lines
 
     def activity_box(self, node, activity):
-        edges = dict([e.order, e] for e in self.edges + self.separators)
-
         # y coodinates for top of activity box
         starts = activity['lifetime'][0]
-        edge = edges[starts]
-        y1 = self.edge(edge).baseheight
+        edge = self.rows[starts]
+        y1 = self.row_baseheight(starts)
         if isinstance(edge, elements.DiagramEdge):
             if edge.diagonal and edge.node2 == node:
                 y1 += self.edge_height * 3 // 4
 
         # y coodinates for bottom of activity box
         ends = activity['lifetime'][-1] + 1
-        if ends < len(edges):
-            y2 = self.edge(edges[ends]).baseheight
+        if ends < len(self.rows):
+            y2 = self.row_baseheight(ends)
         else:
             y2 = self.bottomheight + self.cellsize * 2
 
@@ -201,36 +298,35 @@ class DiagramMetrics(blockdiag.metrics.DiagramMetrics):
 
         return XY(width, height)
 
-    def expand_pagesize_for_note(self, edge):
-        if edge.leftnote:
-            cell = self.cell(edge.left_node)
-            width = cell.center.x - self.cellsize * 6
+    def expand_left_margin_for_note(self, edge):
+        cell = self.cell(edge.left_node)
+        width = cell.center.x - self.cellsize * 6
 
-            if width < edge.leftnotesize.width:
-                span_width = edge.leftnotesize.width - width
-                self.spreadsheet.span_width[0] += span_width
+        if width < edge.leftnotesize.width:
+            span_width = edge.leftnotesize.width - width
+            self.spreadsheet.span_width[0] += span_width
 
-        if edge.rightnote:
-            cell = self.cell(edge.right_node)
-            if edge.direction == 'self':
-                right = self.edge(edge).right
-                width = self.pagesize().width - right - self.cellsize * 3
-            else:
-                width = (self.pagesize().width -
-                         cell.center.x - self.cellsize * 3)
+    def right_margin_for_note(self, edge):
+        """Returns the right margin (span_width[node_count]) for the note"""
+        sheet = self.spreadsheet
+        pagewidth = (sheet.pagesize(self.node_count, 1).width -
+                     sheet.span_width[self.node_count])
+
+        cell = self.cell(edge.right_node)
+        if edge.direction == 'self':
+            right = self.edge(edge).right
+            width = pagewidth - right - self.cellsize * 3
+        else:
+            width = pagewidth - cell.center.x - self.cellsize * 3
 
-            if edge.right_node.xy.x + 1 == self.node_count:
-                width -= self.cellsize * 2
+        if edge.right_node.xy.x + 1 == self.node_count:
+            width -= self.cellsize * 2
 
-            if width < edge.rightnotesize.width:
-                span_width = edge.rightnotesize.width - width
-                self.spreadsheet.span_width[self.node_count] += span_width
+        return edge.rightnotesize.width - width
 
     def cell(self, obj, use_padding=True):
         if isinstance(obj, (elements.DiagramEdge, elements.EdgeSeparator)):
-            klass = namedtuple('_', 'xy width height colwidth colheight')
-            edge = klass(XY(1, obj.order + 1), None, None, 1, 1)
-            return super(DiagramMetrics, self).cell(edge, use_padding=False)
+            return self.row_cell(obj.order)
         elif isinstance(obj, elements.AltBlock):
             box = super(DiagramMetrics, self).cell(obj, use_padding=False)
             return AltBlockMetrics(self, obj, box)
@@ -243,6 +339,21 @@ class DiagramMetrics(blockdiag.metrics.DiagramMetrics):
         else:
             return EdgeMetrics(edge, self)
 
+    def edge_layout(self, edge):
+        """Returns the EdgeLayout of the edge
+
+        The geometry of all edges is computed at the first call and kept;
+        the lifelines of the nodes are located once for all edges.
+        """
+        if self.edge_layouts is None:
+            lifelines = {}
+            self.edge_layouts = [None] * len(self.rows)
+            for e in self.edges:
+                metrics = EdgeMetrics(e, self, lifelines)
+                self.edge_layouts[e.order] = metrics.layout()
+
+        return self.edge_layouts[edge.order]
+
     def separator(self, separator):
         return SeparatorMetrics(separator, self)
 
@@ -272,18 +383,37 @@ class AltBlockMetrics(blockdiag.metrics.NodeMetrics):
 
 
 class EdgeMetrics(object):
-    def __init__(self, edge, metrics):
+    def __init__(self, edge, metrics, lifelines=None):
         self.metrics = metrics
         self.edge = edge
+        self.lifelines = lifelines  # memo of lifeline_x(); node -> x
+
+    def layout(self):
+        """Compute the geometry of the edge; each part only once"""
+        baseheight = self.baseheight
+        right = self.right
+        shaft = self._shaft(baseheight, right)
+        leftnotebox = self._leftnotebox(baseheight)
+        rightnotebox = self._rightnotebox(baseheight, right)
+
+        return EdgeLayout(shaft, self._head(shaft), self._failedmark(shaft),
+                          self._textbox(baseheight),
+                          leftnotebox, self._leftnoteshape(leftnotebox),
+                          rightnotebox, self._rightnoteshape(rightnotebox))
+
+    def lifeline_x(self, node):
+        if self.lifelines is None:
+            return self.metrics.node(node).bottom.x
+
+        x = self.lifelines.get(node)
+        if x is None:
+            x = self.lifelines[node] = self.metrics.node(node).bottom.x
+
+        return x
 
     @property
     def baseheight(self):
-        cell = self.metrics.cell(self.edge)
-        if (cell.height == self.edge.leftnotesize.height or
-           (cell.height == self.edge.rightnotesize.height)):
-            return cell.center.y
-        else:
-            return cell.top.y + self.edge.textheight
+        return self.metrics.row_baseheight(self.edge.order)
 
     @property
     def right(self):
@@ -309,8 +439,10 @@ class EdgeMetrics(object):
 
     @property
     def shaft(self):
+        return self._shaft(self.baseheight, self.right)
+
+    def _shaft(self, baseheight, right):
         m = self.metrics
-        baseheight = self.baseheight
 
         if self.edge.direction == 'self':
             cell = m.cell(self.edge.node1)
@@ -319,16 +451,16 @@ class EdgeMetrics(object):
             # adjust textbox to right on activity-lines
             base_x = cell.bottom.x
             x1 = base_x + self.activity_line_width(self.edge.node1)
-            x2 = self.right
+            x2 = right
 
             line = [XY(x1 + m.cellsize, baseheight),
                     XY(x2, baseheight),
                     XY(x2, baseheight + fold_height),
                     XY(x1 + m.cellsize, baseheight + fold_height)]
         else:
-            x1 = (self.metrics.node(self.edge.left_node).bottom.x +
+            x1 = (self.lifeline_x(self.edge.left_node) +
                   self.activity_line_width(self.edge.left_node))
-            x2 = self.metrics.node(self.edge.right_node).bottom.x
+            x2 = self.lifeline_x(self.edge.right_node)
 
             margin = m.cellsize
             if self.edge.diagonal:
@@ -356,17 +488,20 @@ class EdgeMetrics(object):
 
     @property
     def failedmark(self):
+        return self._failedmark(self.shaft)
+
+    def _failedmark(self, shaft):
         lines = []
         if self.edge.failed:
             r = self.metrics.cellsize
             if self.edge.direction == 'right':
-                pt = self.shaft[-1]
+                pt = shaft[-1]
                 lines.append((XY(pt.x + r, pt.y - r),
                               XY(pt.x + r * 3, pt.y + r)))
                 lines.append((XY(pt.x + r, pt.y + r),
                               XY(pt.x + r * 3, pt.y - r)))
             else:
-                pt = self.shaft[0]
+                pt = shaft[0]
                 lines.append((XY(pt.x - r * 3, pt.y - r),
                               XY(pt.x - r, pt.y + r)))
                 lines.append((XY(pt.x - r * 3, pt.y + r),
@@ -376,21 +511,24 @@ class EdgeMetrics(object):
 
     @property
     def head(self):
+        return self._head(self.shaft)
+
+    def _head(self, shaft):
         cell = self.metrics.cellsize
 
         head = []
         if self.edge.direction == 'right':
-            xy = self.shaft[-1]
+            xy = shaft[-1]
             head.append(XY(xy.x - cell, xy.y - cell // 2))
             head.append(xy)
             head.append(XY(xy.x - cell, xy.y + cell // 2))
         elif self.edge.direction == 'left':
-            xy = self.shaft[0]
+            xy = shaft[0]
             head.append(XY(xy.x + cell, xy.y - cell // 2))
             head.append(xy)
             head.append(XY(xy.x + cell, xy.y + cell // 2))
         else:  # self
-            xy = self.shaft[-1]
+            xy = shaft[-1]
             head.append(XY(xy.x + cell, xy.y - cell // 2))
             head.append(xy)
             head.append(XY(xy.x + cell, xy.y + cell // 2))
@@ -399,39 +537,35 @@ class EdgeMetrics(object):
 
     @property
     def textbox(self):
-        m = self.metrics
+        return self._textbox(self.baseheight)
 
+    def _textbox(self, baseheight):
         if self.edge.direction == 'self':
-            x = m.node(self.edge.node1).bottom.x + \
+            x = self.lifeline_x(self.edge.node1) + \
                 self.activity_line_width(self.edge.node1) + \
                 self.edge.label_margin * 2
         elif self.edge.direction == 'right':
-            x = m.node(self.edge.left_node).bottom.x + \
+            x = self.lifeline_x(self.edge.left_node) + \
                 self.activity_line_width(self.edge.left_node) + \
                 self.edge.label_margin * 2 + \
                 self.metrics.cellsize // 2
         else:  # left
-            x = m.node(self.edge.right_node).bottom.x - \
+            x = self.lifeline_x(self.edge.right_node) - \
                 self.edge.textwidth - \
                 self.edge.label_margin * 2
 
-        y1 = self.baseheight - self.edge.textheight - self.edge.label_margin
+        y1 = baseheight - self.edge.textheight - self.edge.label_margin
         return Box(x, y1, x + self.edge.textwidth, y1 + self.edge.textheight)
 
     def activity_line_width(self, node):
-        m = self.metrics
-
-        index = self.edge.order
-        activities = [a for a in node.activities if index in a['lifetime']]
-        if activities:
-            level = max(a['level'] for a in activities)
-        else:
-            level = 0
-
-        return m.cellsize // 2 * level
+        level = node.activity_level(self.edge.order)
+        return self.metrics.cellsize // 2 * level
 
     @property
     def leftnotebox(self):
+        return self._leftnotebox(self.baseheight)
+
+    def _leftnotebox(self, baseheight):
         if not self.edge.leftnote:
             return Box(0, 0, 0, 0)
 
@@ -440,7 +574,7 @@ class EdgeMetrics(object):
         notesize = self.edge.leftnotesize
 
         x = cell.center.x - m.cellsize * 3 - notesize.width
-        y = self.baseheight - notesize.height // 2
+        y = baseheight - notesize.height // 2
 
         if self.edge.failed and self.edge.direction == 'left':
             x += self.metrics.edge_length // 2 - m.cellsize
@@ -449,40 +583,47 @@ class EdgeMetrics(object):
 
     @property
     def leftnoteshape(self):
+        return self._leftnoteshape(self.leftnotebox)
+
+    def _leftnoteshape(self, box):
         if not self.edge.leftnote:
             return []
 
         r = self.metrics.cellsize
-        box = self.leftnotebox
         return [XY(box[0], box[1]), XY(box[2], box[1]),
                 XY(box[2] + r, box[1] + r), XY(box[2] + r, box[3]),
                 XY(box[0], box[3]), XY(box[0], box[1])]
 
     @property
     def rightnotebox(self):
+        return self._rightnotebox(self.baseheight, self.right)
+
+    def _rightnotebox(self, baseheight, right):
         if not self.edge.rightnote:
             return Box(0, 0, 0, 0)
 
         m = self.metrics
         cell = m.cell(self.edge.right_node)
         if self.edge.direction == 'self':
-            x = self.right + m.cellsize * 2
+            x = right + m.cellsize * 2
         elif self.edge.failed and self.edge.direction == 'right':
-            x = self.right + m.cellsize * 4
+            x = right + m.cellsize * 4
         else:
             x = cell.center.x + m.cellsize * 2
 
         notesize = self.edge.rightnotesize
-        y = self.baseheight - notesize.height // 2
+        y = baseheight - notesize.height // 2
         return Box(x, y, x + notesize.width, y + notesize.height)
 
     @property
     def rightnoteshape(self):
+        return self._rightnoteshape(self.rightnotebox)
+
+    def _rightnoteshape(self, box):
         if not self.edge.rightnote:
             return []
 
         r = self.metrics.cellsize
-        box = self.rightnotebox
         return [XY(box[0], box[1]), XY(box[2], box[1]),
                 XY(box[2] + r, box[1] + r), XY(box[2] + r, box[3]),
                 XY(box[0], box[3]), XY(box[0], box[1])]
@@ -509,7 +650,7 @@ class SeparatorMetrics(object):
 
     @property
     def baseheight(self):
-        return self.metrics.cell(self.separator).top.y
+        return self.metrics.row_baseheight(self.separator.order)
 
     @property
     def baseline(self):
@@ -36,13 +36,18 @@ At the moment, the parser builds only a parse tree, not an abstract syntax tree
 '''
 
 import io
+import pickle
+import re
+import zlib
 from collections import namedtuple
 from re import DOTALL, MULTILINE
 
 from blockdiag.parser import create_mapper, flatten, oneplus_to_list
 from funcparserlib.lexer import LexerError, Token, make_tokenizer
-from funcparserlib.parser import (a, finished, forward_decl, many, maybe, skip,
-                                  some)
+from funcparserlib.parser import (NoParseError, a, finished, forward_decl,
+                                  many, maybe, skip, some)
+
+import seqdiag
 
 Diagram = namedtuple('Diagram', 'id stmts')
 Group = namedtuple('Group', 'stmts')
@@ -54,34 +59,119 @@ Statements = namedtuple('Statements', 'stmts')
 Separator = namedtuple('Separator', 'type value')
 Extension = namedtuple('Extension', 'type name attrs')
 Fragment = namedtuple('Fragment', 'type id stmts')
+Grammar = namedtuple('Grammar', 'dotfile header statements tail')
 
 
 class ParseException(Exception):
-    pass
+    def __init__(self, message, lineno=None, colno=None):
+        super(ParseException, self).__init__(message)
+        self.lineno = lineno
+        self.colno = colno
+
+
+def parse_error(exc, tokens=None):
+    """Convert an error on tokenizing or parsing to ParseException
+
+    The position of the error is taken from LexerError, or for NoParseError,
+    from the offending token in *tokens*.
+    """
+    if isinstance(exc, LexerError):
+        message = "Got unexpected token at line %d column %d" % exc.place
+        return ParseException(message, *exc.place)
+    elif isinstance(exc, NoParseError) and tokens:
+        if exc.state.max < len(tokens):
+            place = tokens[exc.state.max].start
+        else:
+            place = tokens[-1].end  # unexpected end of input
+        return ParseException(str(exc), *place)
+    else:
+        return ParseException(str(exc))
+
+
+# flake8: NOQA
+SPECS = [                                                                 # NOQA
+    ('Comment',   (r'/\*(.|[\r\n])*?\*/', MULTILINE)),                    # NOQA
+    ('Comment',   (r'(//|#).*',)),                                        # NOQA
+    ('NL',        (r'[\r\n]+',)),                                         # NOQA
+    ('Space',     (r'[ \t\r\n]+',)),                                      # NOQA
+    ('Separator', (r'(?P<sep>===|\.\.\.)[^\r\n]+(?P=sep)',)),             # NOQA
+    ('Name',      ('[A-Za-z_0-9\u0080-\uffff]' +                          # NOQA
+                   '[A-Za-z_\\-.0-9\u0080-\uffff]*',)),                   # NOQA
+    ('Op',        (r'(=>)|[{};,=\[\]]|(<<?--?)|(--?>>?)',)),              # NOQA
+    ('Number',    (r'-?(\.[0-9]+)|([0-9]+(\.[0-9]*)?)',)),                # NOQA
+    ('String',    (r'(?P<quote>(""")|(\'\'\')|"|\').*?(?<!\\)(?P=quote)', DOTALL)),  # NOQA
+]
+USELESS_TOKENS = ['Comment', 'NL', 'Space']
 
 
 def tokenize(string):
     """str -> Sequence(Token)"""
-    # flake8: NOQA
-    specs = [                                                             # NOQA
-        ('Comment',   (r'/\*(.|[\r\n])*?\*/', MULTILINE)),                # NOQA
-        ('Comment',   (r'(//|#).*',)),                                    # NOQA
-        ('NL',        (r'[\r\n]+',)),                                     # NOQA
-        ('Space',     (r'[ \t\r\n]+',)),                                  # NOQA
-        ('Separator', (r'(?P<sep>===|\.\.\.)[^\r\n]+(?P=sep)',)),         # NOQA
-        ('Name',      ('[A-Za-z_0-9\u0080-\uffff]' +                      # NOQA
-                       '[A-Za-z_\\-.0-9\u0080-\uffff]*',)),               # NOQA
-        ('Op',        (r'(=>)|[{};,=\[\]]|(<<?--?)|(--?>>?)',)),          # NOQA
-        ('Number',    (r'-?(\.[0-9]+)|([0-9]+(\.[0-9]*)?)',)),            # NOQA
-        ('String',    (r'(?P<quote>(""")|(\'\'\')|"|\').*?(?<!\\)(?P=quote)', DOTALL)),  # NOQA
-    ]
-    useless = ['Comment', 'NL', 'Space']
-    t = make_tokenizer(specs)
-    return [x for x in t(string) if x.type not in useless]
+    return default_parser.tokenize(string)
+
+
+def make_fast_tokenizer(specs, useless=()):
+    """Make a single-pass tokenizer equivalent to make_tokenizer(specs)
+
+    All specs are joined into one regular expression, so each token is
+    matched by a single call into the regex engine.  Tokens of the types in
+    *useless* are skipped without being allocated.  The other tokens (and
+    LexerError) carry the same positions as make_tokenizer() gives.
+    """
+    inline_flags = ((re.IGNORECASE, 'i'), (re.MULTILINE, 'm'),
+                    (re.DOTALL, 's'))
+
+    types = {}
+    patterns = []
+    for i, (name, args) in enumerate(specs):
+        pattern = args[0]
+        if len(args) > 1:
+            flags = ''.join(c for flag, c in inline_flags if args[1] & flag)
+            if flags:
+                pattern = '(?%s:%s)' % (flags, pattern)
+
+        group = 'T%d' % i
+        types[group] = name
+        patterns.append('(?P<%s>%s)' % (group, pattern))
+
+    regexp = re.compile('|'.join(patterns))
+    skipped = set(group for group in types if types[group] in useless)
+
+    def tokenizer(string):
+        line = 1
+        line_start = 0  # index of the first character of the current line
+        j = 0
+        for m in iter(regexp.scanner(string).match, None):
+            i, j = m.span()
+            group = m.lastgroup
+            if group in skipped:
+                nls = string.count('\n', i, j)
+                if nls:
+                    line += nls
+                    line_start = string.rfind('\n', i, j) + 1
+            else:
+                value = m.group()
+                start = (line, i - line_start + 1)
+                if '\n' in value:
+                    line += value.count('\n')
+                    line_start = string.rfind('\n', i, j) + 1
+
+                end = (line, j - line_start)
+                yield Token(types[group], value, start, end)
+
+        if j < len(string):
+            err_line = string.splitlines()[line - 1]
+            raise LexerError((line, j - line_start + 1), err_line)
+
+    return tokenizer
 
 
 def parse(seq):
     """Sequence(Token) -> object"""
+    return default_parser.parse(seq)
+
+
+def create_grammar():
+    """() -> Grammar"""
     tokval = lambda x: x.value
     op = lambda s: a(Token('Op', s)) >> tokval
     op_ = lambda s: skip(op(s))
@@ -252,35 +342,233 @@ def parse(seq):
     )
     dotfile = diagram + skip(finished)
 
-    return dotfile.parse(seq)
+    # pieces of the diagram statement for Parser.iterparse_string()
+    header = maybe(diagram_id) + op_('{') + skip(finished)
+    statements = diagram_inline_stmt_list + skip(finished)
+    tail = diagram_inline_stmt_list + op_('}') + skip(finished)
+
+    return Grammar(dotfile, header, statements, tail)
 
 
 def sort_tree(tree):
-    def weight(node):
-        if isinstance(node, (Attr, Extension)):
-            return 1
-        else:
-            return 2
+    """Move attribute and extension statements to the head of each block
+
+    The relative order of the other statements is kept.  The tree is walked
+    with an explicit stack, so deeply nested blocks do not hit the
+    recursion limit, and each block is partitioned in linear time.
+    """
+    stack = [tree] if hasattr(tree, 'stmts') else []
+    while stack:
+        stmts = stack.pop().stmts
+
+        hoisted = [s for s in stmts if isinstance(s, (Attr, Extension))]
+        if hoisted and len(hoisted) < len(stmts):
+            others = [s for s in stmts
+                      if not isinstance(s, (Attr, Extension))]
+            stmts[:] = hoisted + others
 
-    if hasattr(tree, 'stmts'):
-        tree.stmts.sort(key=lambda x: weight(x))
-        for stmt in tree.stmts:
-            sort_tree(stmt)
+        stack.extend(s for s in stmts if hasattr(s, 'stmts'))
 
     return tree
 
 
+class Parser(object):
+    """A reusable seqdiag parser.
+
+    The grammar and the tokenizer are built once on construction, so one
+    instance can parse any number of diagrams.  Parsing does not modify
+    the instance; it is safe to share a parser between threads.
+
+    With *fast_lexer*, the source is tokenized by make_fast_tokenizer()
+    instead of funcparserlib's make_tokenizer().
+
+    *cache* is a seqdiag.utils.diskcache.DiskCache to keep the parsed trees
+    of parse_string() and parse_file(); they are keyed by the source text
+    and the version of seqdiag.  The entries are pickled, so the cache
+    directory should not be writable by untrusted users.
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, fast_lexer=False, cache=None):
+        self.cache = cache
+        if fast_lexer:
+            self.tokenizer = make_fast_tokenizer(SPECS, USELESS_TOKENS)
+        else:
+            tokenizer = make_tokenizer(SPECS)
+            self.tokenizer = lambda string: (x for x in tokenizer(string)
+                                             if x.type not in USELESS_TOKENS)
+        self.grammar = create_grammar()
+
+    def tokenize(self, string):
+        """str -> Sequence(Token)"""
+        return list(self.tokenizer(string))
+
+    def parse(self, seq):
+        """Sequence(Token) -> object"""
+        return self.grammar.dotfile.parse(seq)
+
+    def parse_string(self, string):
+        if self.cache is None:
+            return self._parse_string(string)
+
+        key = 'seqdiag-%s:%d:%s' % (seqdiag.__version__,
+                                    self.pickle_protocol, string)
+        data = self.cache.get(key)
+        if data is not None:
+            try:
+                return pickle.loads(zlib.decompress(data))
+            except Exception:
+                self.cache.delete(key)  # broken entry
+
+        tree = self._parse_string(string)
+        data = pickle.dumps(tree, self.pickle_protocol)
+        self.cache.set(key, zlib.compress(data, 1))
+        return tree
+
+    def _parse_string(self, string):
+        tokens = None
+        try:
+            tokens = self.tokenize(string)
+            tree = self.parse(tokens)
+            return sort_tree(tree)
+        except Exception as e:
+            raise parse_error(e, tokens)
+
+    def parse_file(self, path):
+        code = io.open(path, 'r', encoding='utf-8-sig').read()
+        return self.parse_string(code)
+
+    def iterparse_string(self, string):
+        """Parse the diagram lazily
+
+        Returns a Diagram whose stmts is an iterator.  The top-level
+        statements are tokenized, parsed and sorted one at a time as the
+        iterator is consumed (e.g. by DiagramTreeBuilder), so neither the
+        whole token list nor the whole parse tree is held in memory.
+
+        To keep the order given by sort_tree(), the top-level attribute and
+        extension statements are collected in a first pass over the source
+        and yielded before the others.  Syntax errors in the statements are
+        raised from the iterator.
+        """
+        header = []
+        try:
+            for token in self.tokenizer(string):
+                header.append(token)
+                if token.type == 'Op' and token.value == '{':
+                    break
+
+            diagram_id = self.grammar.header.parse(header)
+        except Exception as e:
+            raise parse_error(e, header)
+
+        return Diagram(diagram_id, self._iterparse(string))
+
+    def iterparse_file(self, path):
+        code = io.open(path, 'r', encoding='utf-8-sig').read()
+        return self.iterparse_string(code)
+
+    def _iterparse(self, string):
+        chunk = None
+        try:
+            hoisted = []
+            for chunk, grammar in self._iter_chunks(string):
+                if has_toplevel_attribute(chunk):
+                    for stmt in grammar.parse(chunk):
+                        if isinstance(stmt, (Attr, Extension)):
+                            hoisted.append(stmt)
+
+            for stmt in hoisted:
+                yield stmt
+
+            for chunk, grammar in self._iter_chunks(string):
+                for stmt in grammar.parse(chunk):
+                    if not isinstance(stmt, (Attr, Extension)):
+                        yield sort_tree(stmt)
+        except Exception as e:
+            raise parse_error(e, chunk)
+
+    def _iter_chunks(self, string):
+        """Split the body of the diagram into chunks of top-level statements
+
+        A chunk ends with a semicolon or a closing brace at the top level.
+        Yields pairs of a chunk and the grammar to parse it; the last chunk
+        also holds the closing brace of the diagram and any trailing tokens.
+        """
+        tokens = iter(self.tokenizer(string))
+        for token in tokens:  # skip the header
+            if token.type == 'Op' and token.value == '{':
+                break
+
+        chunk = []
+        depth = 0
+        closed = False  # a block statement has just been closed
+        for token in tokens:
+            if closed:
+                closed = False
+                if token.type == 'Op' and token.value == ';':
+                    chunk.append(token)
+                    continue
+
+                yield chunk, self.grammar.statements
+                chunk = []
+
+            chunk.append(token)
+            if token.type != 'Op':
+                continue
+            elif token.value == '{':
+                depth += 1
+            elif token.value == '}':
+                if depth == 0:
+                    chunk.extend(tokens)
+                    break
+
+                depth -= 1
+                if depth == 0:
+                    closed = True
+            elif token.value == ';' and depth == 0:
+                yield chunk, self.grammar.statements
+                chunk = []
+
+        yield chunk, self.grammar.tail
+
+
+def has_toplevel_attribute(tokens):
+    """Sequence(Token) -> bool
+
+    Tells whether the statements might contain an attribute or extension
+    statement at the top level.
+    """
+    depth = 0
+    for token in tokens:
+        if token.type == 'Op':
+            if token.value in ('{', '['):
+                depth += 1
+            elif token.value in ('}', ']'):
+                depth -= 1
+            elif token.value == '=' and depth == 0:
+                return True
+        elif token.type == 'Name' and depth == 0:
+            if token.value in ('class', 'plugin'):
+                return True
+
+    return False
+
+
+default_parser = Parser()
+
+
 def parse_string(string):
-    try:
-        tree = parse(tokenize(string))
-        return sort_tree(tree)
-    except LexerError as e:
-        message = "Got unexpected token at line %d column %d" % e.place
-        raise ParseException(message)
-    except Exception as e:
-        raise ParseException(str(e))
+    return default_parser.parse_string(string)
 
 
 def parse_file(path):
-    code = io.open(path, 'r', encoding='utf-8-sig').read()
-    return parse_string(code)
+    return default_parser.parse_file(path)
+
+
+def iterparse_string(string):
+    return default_parser.iterparse_string(string)
+
+
+def iterparse_file(path):
+    return default_parser.iterparse_file(path)
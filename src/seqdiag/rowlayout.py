@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from itertools import chain
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class PythonBackend(object):
+    """Computes the heights and the offsets of rows with Python lists
+
+    DiagramMetrics measures the texts of the edges one by one, then passes
+    the measured sizes to the backend to compute the layout of all rows at
+    once.  This is the default backend; NumPyBackend does the same with
+    array operations.
+    """
+    name = 'python'
+
+    def edge_heights(self, heights, leftnotes, rightnotes, minimum, start):
+        """Returns the heights of the rows of edges
+
+        The row of i-th edge is as high as the largest of heights[i],
+        leftnotes[i] and rightnotes[i]; the rows from *start* are not
+        lower than *minimum*.
+        """
+        heights = [max(values) for values in
+                   zip(heights, leftnotes, rightnotes)]
+        for i in range(start, len(heights)):
+            if heights[i] < minimum:
+                heights[i] = minimum
+
+        return heights
+
+    def block_spans(self, rows, tops, bottoms, cellsize):
+        """Returns the spans widened by the borders of blocks as {y: delta}
+
+        *tops* and *bottoms* are lists of (row, ylevel) of the blocks.  The
+        span above the row next to the top of blocks is widened by their
+        labels and levels, and the span below their bottom row is widened by
+        their levels.  Blocks starting or ending after *rows* are ignored.
+        """
+        top_levels = {}
+        for y, level in tops:
+            if y <= rows:
+                top_levels[y] = max(level, top_levels.get(y, level))
+
+        bottom_levels = {}
+        for y, level in bottoms:
+            if y <= rows:
+                bottom_levels[y] = max(level, bottom_levels.get(y, level))
+
+        spans = {}
+        for y, level in top_levels.items():
+            spans[y + 1] = cellsize * 5 // 2 * (level - 1) + cellsize
+        for y, level in bottom_levels.items():
+            spans[y + 2] = spans.get(y + 2, 0) + cellsize // 2 * (level - 1)
+
+        return spans
+
+    def offsets(self, node_heights, span_heights):
+        """Returns the tops and the bottoms of the rows
+
+        Each row is placed below the previous row and its span.
+        """
+        tops = []
+        bottoms = []
+        node_height = span_height = 0
+        for height, span in zip(node_heights, span_heights):
+            span_height += span
+            tops.append(node_height + span_height)
+            node_height += height
+            bottoms.append(node_height + span_height)
+
+        return tops, bottoms
+
+
+class NumPyBackend(PythonBackend):
+    """Computes the heights and the offsets of rows with NumPy arrays"""
+    name = 'numpy'
+
+    def edge_heights(self, heights, leftnotes, rightnotes, minimum, start):
+        heights = numpy.maximum(numpy.maximum(heights, leftnotes), rightnotes)
+        heights[start:] = numpy.maximum(heights[start:], minimum)
+        return heights.tolist()
+
+    def block_spans(self, rows, tops, bottoms, cellsize):
+        spans = numpy.zeros(rows + 3, dtype=numpy.int64)
+        widened = numpy.zeros(rows + 3, dtype=bool)
+        for borders, offset in ((tops, 1), (bottoms, 2)):
+            borders = numpy.fromiter(chain.from_iterable(borders),
+                                     dtype=numpy.int64).reshape(-1, 2)
+            borders = borders[borders[:, 0] <= rows]
+
+            levels = numpy.zeros(rows + 1, dtype=numpy.int64)
+            numpy.maximum.at(levels, borders[:, 0], borders[:, 1])
+            y = numpy.unique(borders[:, 0])
+            if offset == 1:
+                spans[y + 1] += cellsize * 5 // 2 * (levels[y] - 1) + cellsize
+            else:
+                spans[y + 2] += cellsize // 2 * (levels[y] - 1)
+            widened[y + offset] = True
+
+        y = numpy.flatnonzero(widened)
+        return dict(zip(y.tolist(), spans[y].tolist()))
+
+    def offsets(self, node_heights, span_heights):
+        node_heights = numpy.array(node_heights)
+        span_heights = numpy.cumsum(span_heights)
+        bottoms = numpy.cumsum(node_heights) + span_heights
+        tops = bottoms - node_heights
+        return tops.tolist(), bottoms.tolist()
+
+
+def get_backend(name='python'):
+    """Returns the backend named *name*
+
+    The NumPy backend is used only when asked for, e.g. by
+    ``DiagramMetrics.rowlayout = get_backend('numpy')`` or the
+    ``--rowlayout=numpy`` option.
+    """
+    if name == 'numpy':
+        if numpy is None:
+            raise RuntimeError("numpy is not installed")
+        return NumPyBackend()
+    elif name == 'python':
+        return PythonBackend()
+    else:
+        raise ValueError("unknown backend: %s" % name)
@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import random
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from blockdiag.utils.fontmap import FontMap
+
+from seqdiag import parser
+from seqdiag.builder import IncrementalBuilder, ScreenNodeBuilder
+from seqdiag.drawer import DiagramDraw
+from seqdiag.elements import BuildContext
+from seqdiag.tests.test_parser import get_sources
+
+
+def build(source):
+    return ScreenNodeBuilder.build(parser.parse_string(source))
+
+
+class TestAltBlock(unittest.TestCase):
+    def test_ylevel(self):
+        diagram = build('{ loop { alt { A -> B; } B -> C; '
+                        'loop { C -> D; } } A -> D; loop { D -> A; } }')
+        levels = [(b.type, b.ylevel_top, b.ylevel_bottom)
+                  for b in diagram.altblocks]
+        self.assertEqual([('loop', 2, 2), ('alt', 1, 1), ('loop', 1, 1),
+                          ('loop', 1, 1)], levels)
+
+    def test_extent(self):
+        diagram = build('{ A; B; C; D; loop { B -> C; alt { C -> D; '
+                        'A <- C {\n=== sep ===\n} } } A -> B; }')
+        extents = [(b.type, tuple(b.xy), b.colwidth, b.colheight)
+                   for b in diagram.altblocks]
+        self.assertEqual([('loop', (0, 1), 4, 4), ('alt', (0, 2), 4, 3)],
+                         extents)
+
+        edges = diagram.edges
+        self.assertEqual(edges[:3], diagram.altblocks[0].edges)
+        self.assertEqual(edges[1:3], diagram.altblocks[1].edges)
+
+    def test_empty_fragment(self):
+        diagram = build('{ A -> B; loop { C; } alt { color = red; } }')
+        self.assertEqual([], diagram.altblocks)
+
+    def test_nested_empty_fragment(self):
+        diagram = build('{ loop { alt { } A -> B; } }')
+        extents = [(b.type, tuple(b.xy), b.colwidth, b.colheight)
+                   for b in diagram.altblocks]
+        self.assertEqual([('loop', (0, 1), 2, 1)], extents)
+
+        diagram = build('{ loop { alt { A -> B; } loop { } alt { B -> C; } '
+                        'loop { loop { } } } }')
+        extents = [(b.type, tuple(b.xy), b.colwidth, b.colheight)
+                   for b in diagram.altblocks]
+        self.assertEqual([('loop', (0, 1), 3, 2), ('alt', (0, 1), 2, 1),
+                          ('alt', (1, 2), 2, 1)], extents)
+
+    def test_ylevel_scales_linearly(self):
+        def altblock_reads(blocks):
+            """Returns the number of attribute reads of altblocks in build"""
+            stmts = ['activation = none;']
+            stmts += ['loop { A -> B; }' for _ in range(blocks)]
+            tree = parser.parse_string('{ %s }' % ' '.join(stmts))
+
+            context = BuildContext()
+            getattribute = context.AltBlock.__getattribute__
+            reads = []
+
+            def counting_getattribute(block, name):
+                reads.append(name)
+                return getattribute(block, name)
+
+            context.AltBlock.__getattribute__ = counting_getattribute
+            ScreenNodeBuilder.build(tree, context=context)
+            return len(reads)
+
+        # each block is read a fixed number of times when linear
+        self.assertEqual(8 * altblock_reads(100), altblock_reads(800))
+
+
+class TestActivities(unittest.TestCase):
+    def activities(self, source):
+        diagram = build(source)
+        return dict((node.id, [(list(a['lifetime']), a['level'])
+                               for a in node.activities])
+                    for node in diagram.nodes)
+
+    def test_activities(self):
+        activities = self.activities('{ A -> B; B -> C;\n=== sep ===\n'
+                                     'C -> B; B => C; A <- B; '
+                                     'D [activated]; }')
+        self.assertEqual([(list(range(0, 7)), 0)], activities['A'])
+        self.assertEqual([(list(range(0, 7)), 0), (list(range(3, 6)), 1)],
+                         activities['B'])
+        self.assertEqual([(list(range(1, 7)), 0), (list(range(4, 5)), 1)],
+                         activities['C'])
+        self.assertEqual([(list(range(0, 7)), 0)], activities['D'])
+
+    def test_reactivated(self):
+        activities = self.activities('{ A -> B; A <- B; A -> C; '
+                                     'A -> B; A <- B; A -> B [noactivate]; }')
+        self.assertEqual([([0], 0), ([3], 0)], activities['B'])
+        self.assertEqual([([2, 3, 4, 5], 0)], activities['C'])
+
+    def test_lifetime_is_interval(self):
+        diagram = build('{ %s }' % ' '.join(['A -> B; A <- B;'] * 1000))
+        activity = diagram.nodes[0].activities[0]
+        self.assertEqual(range(0, 2000), activity['lifetime'])
+
+
+class TestSeparators(unittest.TestCase):
+    def test_rows(self):
+        diagram = build('{ A -> B;\n=== divider ===\nB -> C; A <- B;\n'
+                        '... delay ...\n}')
+        self.assertEqual([0, 2, 3], [e.order for e in diagram.edges])
+        self.assertEqual([('divider', 1), ('delay', 4)],
+                         [(s.type, s.order) for s in diagram.separators])
+        self.assertEqual(6, diagram.colheight)
+
+
+class TestEdges(unittest.TestCase):
+    def edges(self, diagram):
+        return [(e.node1.id, e.node2.id, e.dir, e.label)
+                for e in diagram.edges]
+
+    def test_followers(self):
+        diagram = build('{ A => B => C [label = "call", return = "ret"] '
+                        '{ C -> D; } A -> B <- C; }')
+        self.assertEqual([('A', 'B', 'forward', 'call'),
+                          ('B', 'C', 'forward', 'call'),
+                          ('C', 'D', 'forward', None),
+                          ('B', 'C', 'back', 'ret'),
+                          ('A', 'B', 'back', 'ret'),
+                          ('A', 'B', 'forward', None),
+                          ('B', 'C', 'back', None)], self.edges(diagram))
+        self.assertEqual(list(range(7)), [e.order for e in diagram.edges])
+
+    def test_long_follower_chain(self):
+        hops = 50000
+        followers = [('=>', 'N%d' % (i % 100)) for i in range(2, hops + 1)]
+        stmt = parser.Edge('N0', '=>', 'N1', followers, [], None)
+        diagram = ScreenNodeBuilder.build(parser.Diagram(None, [stmt]))
+
+        self.assertEqual(hops * 2, len(diagram.edges))
+        self.assertEqual(100, len(diagram.nodes))
+        self.assertEqual(('N0', 'N1', 'forward', None),
+                         self.edges(diagram)[0])
+        self.assertEqual(('N99', 'N0', 'forward', None),
+                         self.edges(diagram)[hops - 1])
+        self.assertEqual(('N99', 'N0', 'back', ''),
+                         self.edges(diagram)[hops])
+        self.assertEqual(('N0', 'N1', 'back', ''),
+                         self.edges(diagram)[-1])
+
+    def test_deeply_nested_edge_blocks(self):
+        depth = 50000
+        stmt = None
+        for i in reversed(range(depth)):
+            edge_block = parser.Statements([stmt] if stmt else [])
+            stmt = parser.Edge('N%d' % (i % 100), '=>',
+                               'N%d' % ((i + 1) % 100), [], [], edge_block)
+
+        diagram = ScreenNodeBuilder.build(parser.Diagram(None, [stmt]))
+        edges = self.edges(diagram)
+        self.assertEqual(depth * 2, len(edges))
+        self.assertEqual(('N0', 'N1', 'forward', None), edges[0])
+        self.assertEqual(('N99', 'N0', 'forward', None), edges[depth - 1])
+        self.assertEqual(('N99', 'N0', 'back', ''), edges[depth])
+        self.assertEqual(('N0', 'N1', 'back', ''), edges[-1])
+
+    def test_deeply_nested_fragments(self):
+        depth = 5000
+        stmt = parser.Edge('A', '->', 'B', [], [], None)
+        for i in range(depth):
+            stmt = parser.Fragment('loop', None, [stmt])
+
+        diagram = ScreenNodeBuilder.build(parser.Diagram(None, [stmt]))
+        self.assertEqual(depth, len(diagram.altblocks))
+        self.assertEqual(depth, diagram.altblocks[-1].xlevel)
+        for altblock in diagram.altblocks:
+            self.assertEqual(diagram.edges, altblock.edges)
+
+
+class TestBuildContext(unittest.TestCase):
+    def test_defaults_belong_to_context(self):
+        diagram1 = build('{ default_fontsize = 20; default_note_color = blue; '
+                         'A -> B [note = "n"];\n=== sep ===\n}')
+        diagram2 = build('{ A -> B [note = "n"];\n=== sep ===\n}')
+
+        self.assertEqual(20, diagram1.edges[0].fontsize)
+        self.assertEqual(20, diagram1.separators[0].fontsize)
+        self.assertEqual((0, 0, 255), diagram1.edges[0].notecolor)
+        self.assertEqual(None, diagram2.edges[0].fontsize)
+        self.assertEqual(None, diagram2.separators[0].fontsize)
+        self.assertEqual((255, 182, 193), diagram2.edges[0].notecolor)
+
+    def test_classes_belong_to_context(self):
+        diagram = build('{ class red [color = red]; A [class = red]; '
+                        'A -> B [class = red]; }')
+        self.assertEqual((255, 0, 0), diagram.nodes[0].color)
+        self.assertEqual((255, 0, 0), diagram.edges[0].color)
+
+        with self.assertRaises(AttributeError):
+            build('{ A [class = red]; }')
+
+    def test_render_in_parallel(self):
+        def render(source):
+            diagram = ScreenNodeBuilder.build(parser.parse_string(source))
+            drawer = DiagramDraw('SVG', diagram, None, fontmap=FontMap())
+            drawer.draw()
+            return drawer.save()
+
+        sources = []
+        diagrams = [source for _, source in get_sources()]
+        for i, color in enumerate(['red', 'blue', 'green', 'gray']):
+            diagrams.append('{ default_fontsize = %d; default_linecolor = %s; '
+                            'default_note_color = %s; A -> B [note = "n"]; '
+                            'loop { B -> C; }\n=== sep ===\n}' %
+                            (12 + i * 4, color, color))
+        for source in diagrams:
+            if 'plugin' not in source:
+                try:
+                    expected = render(source)
+                except Exception:
+                    continue  # diagrams for error cases
+                sources.append((source, expected))
+
+        jobs = sources * 8
+        random.Random(0).shuffle(jobs)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = executor.map(render, [source for source, _ in jobs])
+            for (source, expected), result in zip(jobs, results):
+                self.assertEqual(expected, result)
+
+
+class TestIncrementalBuilder(unittest.TestCase):
+    nodes = ['A', 'B', 'C', 'D', 'E']
+
+    def random_statement(self, rand, depth=0):
+        choice = rand.random()
+        if choice < 0.1 and depth == 0:
+            return '=== sep %d ===' % rand.randrange(100)
+        elif choice < 0.2 and depth < 2:
+            stmts = [self.random_statement(rand, depth + 1)
+                     for _ in range(rand.randrange(3))]
+            return 'loop { %s }' % '\n'.join(stmts)
+        elif choice < 0.25:
+            # refers to nodes not declared at the head; they appear and
+            # disappear with the edits
+            return 'N%d -> %s;' % (rand.randrange(3),
+                                   rand.choice(self.nodes + ['N3', 'N4']))
+        elif choice < 0.3:
+            return 'default_fontsize = %d;' % rand.choice([11, 12])
+
+        node1, node2 = rand.sample(self.nodes, 2)
+        edge_type = rand.choice(['->', '-->', '=>', '<-', '<<--'])
+        edge = '%s %s %s [label = "%d"]' % (node1, edge_type, node2,
+                                            rand.randrange(100))
+        if rand.random() < 0.2:
+            edge += ' { %s -> %s }' % tuple(rand.sample(self.nodes, 2))
+        return edge + ';'
+
+    def signature(self, diagram):
+        def node_id(node):
+            return node and node.id
+
+        rows = []
+        for row in sorted(diagram.edges + diagram.separators,
+                          key=lambda r: r.order):
+            active = [(node.id, a['level']) for node in diagram.nodes
+                      for a in node.activities if row.order in a['lifetime']]
+            rows.append((row.order, node_id(getattr(row, 'node1', None)),
+                         node_id(getattr(row, 'node2', None)),
+                         getattr(row, 'label', None),
+                         getattr(row, 'direction', None), sorted(active)))
+
+        altblocks = [(b.type, b.xy, b.colwidth, b.colheight, b.xlevel,
+                      b.ylevel_top, b.ylevel_bottom)
+                     for b in diagram.altblocks]
+        nodes = [(node.id, node.xy, node.activities)
+                 for node in diagram.nodes]
+        return (rows, altblocks, nodes, diagram.colwidth, diagram.colheight)
+
+    def test_random_edits(self):
+        rand = random.Random(0)
+        stmts = ['%s;' % node for node in self.nodes]
+        stmts += [self.random_statement(rand) for _ in range(10)]
+
+        builder = IncrementalBuilder()
+        builder.build(parser.parse_string('{ %s }' % '\n'.join(stmts)))
+        previous = self.signature(builder.diagram)
+        layout = self.layout('{ %s }' % '\n'.join(stmts))
+        patched = 0
+        for _ in range(200):
+            index = rand.randrange(len(self.nodes), len(stmts) + 1)
+            choice = rand.random()
+            if choice < 0.3 and index < len(stmts):
+                del stmts[index]
+            elif choice < 0.6 and index < len(stmts):
+                stmts[index] = self.random_statement(rand)
+            else:
+                stmts.insert(index, self.random_statement(rand))
+
+            source = '{ %s }' % '\n'.join(stmts)
+            update = builder.update(parser.parse_string(source))
+            signature = self.signature(update.diagram)
+            self.assertEqual(self.signature(build(source)), signature)
+
+            rows, nodes, pagesize = self.layout(source)
+            if not update.rebuilt:
+                patched += 1
+                for i, row in enumerate(previous[0]):
+                    if i not in update.dirty_rows and i < len(signature[0]):
+                        self.assertEqual(row, signature[0][i])
+                        self.assertEqual(layout[0][i], rows[i])
+                if (nodes, pagesize.width) != (layout[1], layout[2].width):
+                    self.assertEqual(range(0, len(rows)), update.dirty_rows)
+                if pagesize.height != layout[2].height:
+                    self.assertEqual(len(rows), update.dirty_rows.stop)
+            previous = signature
+            layout = rows, nodes, pagesize
+
+        self.assertGreater(patched, 100)
+
+    def layout(self, source):
+        """Returns the boxes of the rows and the nodes, and the page size"""
+        diagram = build(source)
+        drawer = DiagramDraw('SVG', diagram, None, fontmap=FontMap())
+        metrics = drawer.metrics
+        rows = [metrics.row_cell(order).box
+                for order in range(len(diagram.edges) +
+                                   len(diagram.separators))]
+        nodes = [metrics.cell(node).box for node in diagram.nodes]
+        return rows, nodes, drawer.pagesize()
+
+    def test_dirty_rows_after_layout(self):
+        stmts = ['A; B; C;', 'A -> B [label = "x"];', 'B -> C;',
+                 'C -> A [label = "y"];', 'A -> C;']
+        edits = [
+            (2, 'B -> C [color = red, style = dashed];', range(1, 2)),
+            (2, 'B -> C [label = "x\\ny\\nz"];', range(1, 4)),
+            (2, 'B -> C [label = "very long label of the edge"];',
+             range(1, 4)),
+            (2, 'A -> C;', range(1, 4)),
+            (2, 'B -> C [note = "note\\nof\\nlines"];', range(0, 4)),
+            (2, 'B -> C [leftnote = "note"];', range(0, 4)),
+            (2, 'loop { B -> C; }', range(0, 4)),
+            (2, 'alt { B -> C; C -> A; }', range(0, 5)),
+            (2, '=== separator ===', range(1, 4)),
+            (4, 'A -> C [label = "y"];', range(3, 4)),
+        ]
+        source = '{ %s }' % ' '.join(stmts)
+        before = self.layout(source)
+        for index, stmt, expected in edits:
+            builder = IncrementalBuilder()
+            builder.build(parser.parse_string(source))
+
+            edited = '{ %s }' % ' '.join(stmts[:index] + [stmt] +
+                                         stmts[index + 1:])
+            update = builder.update(parser.parse_string(edited))
+            self.assertFalse(update.rebuilt)
+            self.assertEqual(expected, update.dirty_rows, stmt)
+
+            rows, nodes, pagesize = self.layout(edited)
+            if nodes != before[1] or pagesize.width != before[2].width:
+                self.assertEqual(range(0, len(rows)), update.dirty_rows,
+                                 stmt)
+            if pagesize.height != before[2].height:
+                self.assertEqual(len(rows), update.dirty_rows.stop, stmt)
+            for order, box in enumerate(before[0]):
+                if order not in update.dirty_rows and order < len(rows):
+                    self.assertEqual(box, rows[order], stmt)
+
+        # fragments and notes having the same sizes
+        stmts[2] = 'loop { B -> C [note = "note"]; }'
+        source = '{ %s }' % ' '.join(stmts)
+        builder = IncrementalBuilder()
+        builder.build(parser.parse_string(source))
+        stmts[2] = 'loop { color = red; B -> C [note = "note", color = red]; }'
+        update = builder.update(parser.parse_string(
+            '{ %s }' % ' '.join(stmts)))
+        self.assertFalse(update.rebuilt)
+        self.assertEqual(range(1, 2), update.dirty_rows)
+
+    def test_first_references_after_patch(self):
+        builder = IncrementalBuilder()
+        builder.build(parser.parse_string('{ A -> B; B -> C; }'))
+        update = builder.update(parser.parse_string('{ A -> B; A -> B; '
+                                                    'B -> C; }'))
+        self.assertFalse(update.rebuilt)
+
+        # C is referred first by the changed statement
+        source = '{ A -> B; A -> B; B -> A; }'
+        update = builder.update(parser.parse_string(source))
+        self.assertTrue(update.rebuilt)
+        self.assertEqual(['A', 'B'], [n.id for n in update.diagram.nodes])
+        self.assertEqual(2, update.diagram.colwidth)
+        self.assertEqual(self.signature(build(source)),
+                         self.signature(update.diagram))
+
+    def test_update_before_build(self):
+        builder = IncrementalBuilder()
+        update = builder.update(parser.parse_string('{ A -> B; B -> C; }'))
+        self.assertTrue(update.rebuilt)
+        self.assertEqual(range(0, 2), update.dirty_rows)
+        self.assertEqual(['A', 'B', 'C'],
+                         [n.id for n in update.diagram.nodes])
+
+    def test_update_after_failed_patch(self):
+        builder = IncrementalBuilder()
+        builder.build(parser.parse_string('{ A -> B; B -> C; }'))
+        with self.assertRaises(AttributeError):
+            builder.update(parser.parse_string('{ A -> B; B -> C; '
+                                               'A -> B [colr = red]; }'))
+        self.assertIsNone(builder.diagram)
+
+        source = '{ A -> B; B -> C [label = "ok"]; }'
+        update = builder.update(parser.parse_string(source))
+        self.assertTrue(update.rebuilt)
+        self.assertEqual(self.signature(build(source)),
+                         self.signature(update.diagram))
+
+    def test_rebuild(self):
+        builder = IncrementalBuilder()
+        builder.build(parser.parse_string('{ A -> B; B -> C; A -> C; }'))
+
+        update = builder.update(parser.parse_string('{ A -> B; B -> C; '
+                                                    'C -> A; }'))
+        self.assertFalse(update.rebuilt)
+        self.assertEqual(range(2, 3), update.dirty_rows)
+
+        update = builder.update(parser.parse_string('{ A -> B; B -> C; '
+                                                    'C -> D; }'))
+        self.assertTrue(update.rebuilt)
+        self.assertEqual(['A', 'B', 'C', 'D'],
+                         [node.id for node in update.diagram.nodes])
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import io
+import os
+import pstats
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+
+from blockdiag.tests.utils import TemporaryDirectory
+
+from seqdiag import rowlayout
+from seqdiag.command import SeqdiagApp, main
+from seqdiag.metrics import DiagramMetrics
+from seqdiag.utils.diskcache import DiskCache
+from seqdiag.utils.textcache import TextCache
+
+
+class TestCheckOption(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmpdir.clean()
+
+    def write(self, filename, source):
+        path = os.path.join(self._tmpdir.name, filename)
+        with io.open(path, 'w', encoding='utf-8') as fp:
+            fp.write(source)
+
+        return path
+
+    def check(self, *args):
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            ret = main(['--check'] + list(args))
+
+        return ret, stdout.getvalue().splitlines()
+
+    def test_valid_diagrams(self):
+        path1 = self.write('valid1.diag', '{ A -> B; }')
+        path2 = self.write('valid2.diag', '{ A -> B [label = "hello"]; }')
+
+        self.assertEqual((0, []), self.check(path1, path2))
+        self.assertFalse(os.path.exists(path1[:-5] + '.png'))
+
+    def test_invalid_diagrams(self):
+        valid = self.write('valid.diag', '{ A -> B; }')
+        syntax_error = self.write('syntax.diag', '{\n  A -> ;\n}\n')
+        lexer_error = self.write('lexer.diag', '{ A ! B }')
+        build_error = self.write('build.diag', '{ A -> B [colr = red]; }')
+        missing = os.path.join(self._tmpdir.name, 'missing.diag')
+
+        ret, lines = self.check(syntax_error, valid, lexer_error,
+                                build_error, missing)
+        self.assertEqual(1, ret)
+        self.assertEqual(4, len(lines))
+        self.assertTrue(lines[0].startswith(syntax_error + ':2:8: '))
+        self.assertEqual(lexer_error + ':1:5: '
+                         'Got unexpected token at line 1 column 5', lines[1])
+        self.assertEqual(build_error + ':0:0: '
+                         'Unknown attribute: DiagramEdge.colr', lines[2])
+        self.assertTrue(lines[3].startswith(missing + ':0:0: '))
+
+    def test_jobs(self):
+        paths = [self.write('diagram%d.diag' % i, '{ A -> B; }')
+                 for i in range(4)]
+        paths.append(self.write('invalid.diag', '{ A -> }'))
+
+        ret, lines = self.check('-j', '2', *paths)
+        self.assertEqual(1, ret)
+        self.assertEqual(1, len(lines))
+        self.assertTrue(lines[0].startswith(paths[-1] + ':1:8: '))
+
+    def test_parse_cache(self):
+        cachedir = os.path.join(self._tmpdir.name, 'cache')
+        path = self.write('valid.diag', '{ A -> B; }')
+
+        self.assertEqual((0, []), self.check('--parse-cache', cachedir, path))
+        self.assertEqual(1, len(os.listdir(cachedir)))
+
+
+class TestTextCacheOption(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmpdir.clean()
+
+    def test_text_cache(self):
+        cachedir = os.path.join(self._tmpdir.name, 'cache')
+        path = os.path.join(self._tmpdir.name, 'diagram.diag')
+        with io.open(path, 'w', encoding='utf-8') as fp:
+            fp.write('{ A -> B [label = "hello"]; B -> A [label = "ok"]; }')
+
+        output = os.path.join(self._tmpdir.name, 'diagram.svg')
+        self.assertEqual(0, main(['-Tsvg', '-o', output, '--text-cache',
+                                  cachedir, path]))
+        with io.open(output, encoding='utf-8') as fp:
+            expected = fp.read()
+
+        textcache = TextCache(store=DiskCache(cachedir))
+        textcache.load()
+        self.assertEqual(2, len(textcache))
+
+        os.unlink(output)
+        self.assertEqual(0, main(['-Tsvg', '-o', output, '--text-cache',
+                                  cachedir, path]))
+        with io.open(output, encoding='utf-8') as fp:
+            self.assertEqual(expected, fp.read())
+
+
+class TestRowLayoutOption(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = TemporaryDirectory()
+        self.path = os.path.join(self._tmpdir.name, 'diagram.diag')
+        with io.open(self.path, 'w', encoding='utf-8') as fp:
+            fp.write('{ A -> B [note = "note"]; loop { B -> C; } }')
+        self.output = os.path.join(self._tmpdir.name, 'diagram.svg')
+
+    def tearDown(self):
+        self._tmpdir.clean()
+
+    def render(self, *args):
+        args = ['-Tsvg', '-o', self.output] + list(args) + [self.path]
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            ret = main(args)
+
+        if ret != 0:
+            return ret, stderr.getvalue()
+        with io.open(self.output, encoding='utf-8') as fp:
+            return ret, fp.read()
+
+    def test_rowlayout(self):
+        ret, expected = self.render()
+        self.assertEqual(0, ret)
+        self.assertEqual((0, expected), self.render('--rowlayout=python'))
+
+        if rowlayout.numpy is None:
+            ret, message = self.render('--rowlayout=numpy')
+            self.assertEqual(-1, ret)
+            self.assertIn('numpy is not installed', message)
+        else:
+            self.assertEqual((0, expected), self.render('--rowlayout=numpy'))
+
+        self.assertEqual('python', DiagramMetrics.rowlayout.name)
+
+
+class TestStatsOption(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = TemporaryDirectory()
+        self.path = os.path.join(self._tmpdir.name, 'diagram.diag')
+        with io.open(self.path, 'w', encoding='utf-8') as fp:
+            fp.write('{ A -> B [label = "hello"]; loop { B -> C; }\n'
+                     '  === separator ===\n'
+                     '  C -> A [label = "hello"]; }')
+        self.output = os.path.join(self._tmpdir.name, 'diagram.svg')
+
+    def tearDown(self):
+        self._tmpdir.clean()
+
+    def test_stats(self):
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            ret = main(['-Tsvg', '-o', self.output, '--stats', self.path])
+
+        self.assertEqual(0, ret)
+        self.assertTrue(os.path.exists(self.output))
+
+        lines = stderr.getvalue().splitlines()
+        phases = [line.split()[0] for line in lines[1:7]]
+        self.assertEqual(['parse', 'build', 'metrics', 'draw', 'save',
+                          'total'], phases)
+        self.assertIn('RSS growth', lines[0])
+        self.assertIn('participants: 3', lines)
+        self.assertIn('edges: 3', lines)
+        self.assertIn('separators: 1', lines)
+        self.assertIn('altblocks: 1', lines)
+        self.assertIn('text measurements', stderr.getvalue())
+        self.assertIn('parse cache: disabled', lines)
+
+    def test_trace_memory(self):
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            ret = main(['-Tsvg', '-o', self.output, '--stats',
+                        '--trace-memory', self.path])
+
+        self.assertEqual(0, ret)
+        lines = stderr.getvalue().splitlines()
+        self.assertIn('peak memory', lines[0])
+        for line in lines[1:6]:
+            self.assertTrue(line.endswith('MB'), line)
+
+    def test_stats_with_parse_cache(self):
+        cachedir = os.path.join(self._tmpdir.name, 'cache')
+        for expected in ('0/1 (0.0%)', '1/1 (100.0%)'):
+            stderr = io.StringIO()
+            with redirect_stderr(stderr):
+                ret = main(['-Tsvg', '-o', self.output, '--stats',
+                            '--parse-cache', cachedir, self.path])
+
+            self.assertEqual(0, ret)
+            self.assertIn('parse cache hits: ' + expected,
+                          stderr.getvalue().splitlines())
+
+    def test_options_parsed_once(self):
+        parsed = []
+
+        class App(SeqdiagApp):
+            def parse_options(self, args):
+                super(App, self).parse_options(args)
+                parsed.append(self.options)
+
+        self.assertEqual(0, App().run(['-Tsvg', '-o', self.output,
+                                       self.path]))
+        self.assertEqual(2, len(parsed))  # by SeqdiagApp and Application
+        self.assertIs(parsed[0], parsed[1])
+
+    def test_without_stats(self):
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            ret = main(['-Tsvg', '-o', self.output, self.path])
+
+        self.assertEqual(0, ret)
+        self.assertEqual('', stderr.getvalue())
+
+    def test_profile(self):
+        profile = os.path.join(self._tmpdir.name, 'seqdiag.prof')
+        self.assertEqual(0, main(['-Tsvg', '-o', self.output,
+                                  '--profile', profile, self.path]))
+
+        stats = pstats.Stats(profile)
+        functions = [func for _, _, func in stats.stats]
+        self.assertIn('render_diagram', functions)
+
+    def test_profile_collapsed(self):
+        profile = os.path.join(self._tmpdir.name, 'seqdiag.folded')
+        self.assertEqual(0, main(['-Tsvg', '-o', self.output,
+                                  '--profile', profile, self.path]))
+
+        with io.open(profile, encoding='utf-8') as fp:
+            for line in fp:
+                stack, count = line.rsplit(' ', 1)
+                self.assertTrue(int(count) > 0)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import unittest
+
+from seqdiag import parser
+from seqdiag.builder import ScreenNodeBuilder
+from seqdiag.compact import StatementTable
+from seqdiag.tests.test_parser import get_sources
+
+
+class TestStatementTable(unittest.TestCase):
+    def assertRoundTrip(self, tree):
+        table = StatementTable.from_tree(tree)
+        result = table.to_tree()
+        self.assertEqual(tree.id, result.id)
+        self.assertEqual(tree.stmts, list(result.stmts))
+
+    def test_diagram_files(self):
+        for path, source in get_sources():
+            with self.subTest(path=path):
+                self.assertRoundTrip(parser.parse_string(source))
+
+    def test_statements(self):
+        source = ('diagram { class red [color = red]; A; B [label = "b"]; '
+                  'group { C; D; color = blue; } '
+                  'A -> B -> C [diagonal, label = foo] { C -> D;\n'
+                  '=== sep ===\n} A -> D {}\n=== "quoted" ===\n'
+                  'loop { alt bar { A -> B; } color = red; } }')
+        self.assertRoundTrip(parser.parse_string(source))
+
+    def test_interned_strings(self):
+        tree = parser.parse_string('{ A -> B [label = "x"]; '
+                                   'B -> A [label = "x"]; }')
+        table = StatementTable.from_tree(tree)
+
+        self.assertEqual(2, len(table))
+        self.assertEqual(['A', '->', 'B', 'label', '"x"'], table.strings)
+
+    def test_iterparse(self):
+        for path, source in get_sources():
+            with self.subTest(path=path):
+                tree = parser.iterparse_string(source)
+                table = StatementTable.from_tree(tree)
+                self.assertEqual(parser.parse_string(source).stmts,
+                                 list(table.iter_statements()))
+
+    def test_deeply_nested_blocks(self):
+        depth = 5000
+        tree = innermost = parser.Diagram(None, [])
+        for _ in range(depth):
+            fragment = parser.Fragment('alt', None, [])
+            innermost.stmts.append(fragment)
+            innermost = fragment
+        innermost.stmts.append(parser.Node('A', []))
+
+        table = StatementTable.from_tree(tree)
+        self.assertEqual(depth + 1, len(table))
+
+        stmt = next(table.iter_statements())
+        for _ in range(depth):
+            self.assertIsInstance(stmt, parser.Fragment)
+            stmt = stmt.stmts[0]
+        self.assertEqual(parser.Node('A', []), stmt)
+
+    def test_build(self):
+        source = ('{ A -> B [label = "call"] { B -> C;\n=== sep ===\n}; '
+                  'loop { C -> A [note = "note"]; } default_fontsize = 16 }')
+        table = StatementTable.from_tree(parser.parse_string(source))
+
+        diagram = ScreenNodeBuilder.build(table)
+        self.assertEqual(['A', 'B', 'C'], [n.id for n in diagram.nodes])
+        self.assertEqual(['call', None, None],
+                         [e.label or None for e in diagram.edges])
+        self.assertEqual(['sep'], [s.label for s in diagram.separators])
+        self.assertEqual(1, len(diagram.altblocks))
+        self.assertEqual(16, diagram.fontsize)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+from blockdiag.tests.utils import TemporaryDirectory
+
+from seqdiag import parser
+from seqdiag.utils.diskcache import DiskCache
+
+
+def parse_with_cache(args):
+    path, source = args
+    return parser.Parser(cache=DiskCache(path)).parse_string(source)
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmpdir.clean()
+
+    @property
+    def tmpdir(self):
+        return self._tmpdir.name
+
+    def test_get_and_set(self):
+        cache = DiskCache(os.path.join(self.tmpdir, 'cache'))
+        self.assertIsNone(cache.get('key'))
+
+        cache.set('key', b'value')
+        self.assertEqual(b'value', cache.get('key'))
+        self.assertIsNone(cache.get('other'))
+        self.assertEqual(5, cache.size())
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+
+        cache.set('key', b'new value')
+        self.assertEqual(b'new value', cache.get('key'))
+
+        cache.delete('key')
+        self.assertIsNone(cache.get('key'))
+
+    def test_no_temporary_files(self):
+        cache = DiskCache(self.tmpdir)
+        for i in range(10):
+            cache.set('key%d' % i, b'x' * i)
+
+        self.assertEqual(10, len(os.listdir(self.tmpdir)))
+        for filename in os.listdir(self.tmpdir):
+            self.assertTrue(filename.endswith(DiskCache.suffix))
+
+    def test_evict(self):
+        cache = DiskCache(self.tmpdir, max_size=100)
+        for i in range(5):
+            cache.set('key%d' % i, b'x' * 20)
+            path = cache.filename('key%d' % i)
+            os.utime(path, (i, i))
+
+        cache.evict()  # not exceeded
+        self.assertEqual(100, cache.size())
+
+        cache.get('key0')  # key0 is used recently
+        cache.set('key5', b'x' * 20)
+        cache.evict()
+        self.assertLessEqual(cache.size(), 90)
+        self.assertEqual(b'x' * 20, cache.get('key0'))
+        self.assertIsNone(cache.get('key1'))
+        self.assertIsNone(cache.get('key2'))
+        self.assertEqual(b'x' * 20, cache.get('key5'))
+
+    def test_parse_string_with_cache(self):
+        source = '{ A -> B [label = "hello"]; default_fontsize = 16; }'
+        cache = DiskCache(self.tmpdir)
+        p = parser.Parser(cache=cache)
+
+        tree = p.parse_string(source)
+        self.assertEqual(parser.parse_string(source), tree)
+        self.assertEqual(1, len(cache.entries()))
+
+        # cached tree is used (even if the parser gets broken)
+        p.tokenize = None
+        self.assertEqual(tree, p.parse_string(source))
+        self.assertIsNot(tree, p.parse_string(source))
+
+    def test_parse_string_with_broken_cache(self):
+        source = '{ A -> B; }'
+        cache = DiskCache(self.tmpdir)
+        p = parser.Parser(cache=cache)
+        p.parse_string(source)
+
+        _, _, path = cache.entries()[0]
+        with open(path, 'wb') as fp:
+            fp.write(b'broken')
+
+        self.assertEqual(parser.parse_string(source), p.parse_string(source))
+
+    def test_parse_error_is_not_cached(self):
+        cache = DiskCache(self.tmpdir)
+        p = parser.Parser(cache=cache)
+        with self.assertRaises(parser.ParseException):
+            p.parse_string('{ A -> ; }')
+
+        self.assertEqual([], cache.entries())
+
+    def test_shared_between_processes(self):
+        sources = ['{ N%d -> N%d; }' % (i % 5, i % 7) for i in range(40)]
+        expected = [parser.parse_string(s) for s in sources]
+
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            args = [(self.tmpdir, s) for s in sources]
+            results = list(executor.map(parse_with_cache, args))
+
+        self.assertEqual(expected, results)
+        self.assertEqual(35, len(DiskCache(self.tmpdir).entries()))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import pickle
+import random
+import unittest
+
+from seqdiag.elements import Diagram, DiagramNode, NodeGroup, NodeList
+
+
+class TestNodeList(unittest.TestCase):
+    def assertMembers(self, expected, nodes):
+        self.assertEqual(expected, list(nodes))
+        for item in 'ABCDEFG':
+            self.assertEqual(item in expected, item in nodes)
+
+    def test_list_operations(self):
+        nodes = NodeList('AB')
+        self.assertMembers(['A', 'B'], nodes)
+
+        nodes.append('C')
+        nodes.insert(0, 'D')
+        nodes += ['E']
+        self.assertMembers(['D', 'A', 'B', 'C', 'E'], nodes)
+
+        nodes.remove('A')
+        self.assertEqual('E', nodes.pop())
+        self.assertEqual(1, nodes.index('B'))
+        self.assertMembers(['D', 'B', 'C'], nodes)
+
+        nodes[0] = 'F'
+        nodes[1:] = ['G']
+        self.assertMembers(['F', 'G'], nodes)
+
+        del nodes[0]
+        self.assertMembers(['G'], nodes)
+
+        nodes.clear()
+        self.assertMembers([], nodes)
+
+    def test_duplicated_items(self):
+        nodes = NodeList('AAB')
+        nodes.remove('A')
+        self.assertMembers(['A', 'B'], nodes)
+
+        nodes *= 2
+        del nodes[:3]
+        self.assertMembers(['B'], nodes)
+
+    def test_pickle(self):
+        nodes = pickle.loads(pickle.dumps(NodeList('AB')))
+        self.assertIsInstance(nodes, NodeList)
+        self.assertMembers(['A', 'B'], nodes)
+
+    def test_nodes_of_groups(self):
+        self.assertIsInstance(Diagram().nodes, NodeList)
+        self.assertIsInstance(NodeGroup(None).nodes, NodeList)
+        self.assertIsInstance(NodeGroup(None).duplicate().nodes, NodeList)
+
+
+class TestDiagramNode(unittest.TestCase):
+    def test_activity_level(self):
+        rand = random.Random(0)
+        for _ in range(100):
+            node = DiagramNode(None)
+            for _ in range(rand.randrange(10)):
+                start = rand.randrange(30)
+                node.activities.append({
+                    'lifetime': range(start, start + rand.randrange(1, 10)),
+                    'level': rand.randrange(4)
+                })
+            node.index_activities()
+
+            for row in range(-1, 42):
+                levels = [a['level'] for a in node.activities
+                          if row in a['lifetime']]
+                self.assertEqual(max(levels, default=0),
+                                 node.activity_level(row))
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import random
+import unittest
+from collections import defaultdict, namedtuple
+
+import blockdiag.metrics
+from blockdiag.utils import XY
+from blockdiag.utils.fontmap import FontMap
+
+from seqdiag import parser
+from seqdiag.builder import ScreenNodeBuilder
+from seqdiag.drawer import DiagramDraw
+
+
+def build(source):
+    diagram = ScreenNodeBuilder.build(parser.parse_string(source))
+    drawer = DiagramDraw('SVG', diagram, None, fontmap=FontMap())
+    return diagram, drawer.metrics
+
+
+def random_statements(rand, depth=0):
+    stmts = []
+    for _ in range(rand.randrange(1, 5)):
+        if depth < 3 and rand.random() < 0.4:
+            stmts.append('%s { %s }' % (rand.choice(['loop', 'alt']),
+                                        random_statements(rand, depth + 1)))
+        elif depth == 0 and rand.random() < 0.1:
+            stmts.append('=== separator ===')
+        else:
+            edge = 'N%d -> N%d' % tuple(rand.sample(range(6), 2))
+            if rand.random() < 0.2:
+                edge += ' [note = "note\\nof\\nlines"]'
+            elif rand.random() < 0.5:
+                edge += ' [label = "label"]'
+            stmts.append(edge + ';')
+
+    return ' '.join(stmts)
+
+
+class TestDiagramMetrics(unittest.TestCase):
+    def test_span_width(self):
+        rand = random.Random(0)
+        for _ in range(50):
+            source = '{ N0; N1; N2; N3; N4; N5; %s }' % random_statements(rand)
+            diagram, metrics = build(source)
+
+            # count the borders of blocks on each cell
+            borders = defaultdict(int)
+            for block in diagram.altblocks:
+                x1, y1 = block.xy
+                for y in range(y1, y1 + block.colheight):
+                    borders[(x1, y)] += 1
+                    borders[(x1 + block.colwidth, y)] += 1
+
+            for x in range(metrics.node_count + 1):
+                depth = max([n for (x_, _), n in borders.items() if x_ == x],
+                            default=None)
+                if depth is not None:
+                    self.assertEqual(metrics.span_width +
+                                     depth * metrics.cellsize,
+                                     metrics.spreadsheet.span_width[x])
+
+    def test_row_cell(self):
+        Cell = namedtuple('Cell', 'xy width height colwidth colheight')
+        rand = random.Random(0)
+        for _ in range(20):
+            source = '{ N0; N1; N2; N3; N4; N5; %s }' % random_statements(rand)
+            diagram, metrics = build(source)
+
+            # compare with the cells calculated by the spreadsheet
+            sheet = blockdiag.metrics.DiagramMetrics
+            for row in diagram.edges + diagram.separators:
+                cell = Cell(XY(1, row.order + 1), None, None, 1, 1)
+                expected = sheet.cell(metrics, cell, use_padding=False)
+                self.assertEqual(expected.box, metrics.cell(row).box)
+
+    def test_edge_layout(self):
+        source = ('{ A -> B [note = "note"]; B -> B [label = "self", '
+                  'rightnote = "note"]; B -> C [failed, leftnote = "note"];'
+                  'C ->> A [diagonal, label = "diagonal"]; '
+                  'A <- C [failed, rightnote = "note"]; '
+                  'A => B [label = "call", return = "return"] { B -> C; }'
+                  '=== separator === }')
+        diagram, metrics = build(source)
+        for edge in diagram.edges:
+            layout = metrics.edge_layout(edge)
+            edge_metrics = metrics.edge(edge)
+            for name in layout._fields:
+                self.assertEqual(getattr(edge_metrics, name),
+                                 getattr(layout, name))
+
+    def test_lifeline(self):
+        diagram, metrics = build('{ A -> B; ... delay ...; B -> C; '
+                                 '=== separator ===; C -> A; '
+                                 '... delay ...; A -> B; }')
+        delays = [metrics.cell(sep) for sep in diagram.separators
+                  if sep.type == 'delay']
+        bottom = metrics.bottomheight + metrics.cellsize * 4
+        d = metrics.cellsize
+        for node in diagram.nodes:
+            x, y = metrics.node(node).bottom
+            expected = []
+            for cell in delays:
+                expected.append(((XY(x, y), XY(x, cell.top.y)), '8,4'))
+                expected.append(((XY(x, cell.top.y + d),
+                                  XY(x, cell.bottom.y - d)), '2,8'))
+                y = cell.bottom.y
+            expected.append(((XY(x, y), XY(x, bottom)), '8,4'))
+
+            self.assertEqual(expected, metrics.lifeline(node))
+
+    def test_note_margins(self):
+        source = ('{ A -> B [leftnote = "short"]; B -> B [rightnote = "long '
+                  'long note"]; C -> A [leftnote = "very very long note"];'
+                  'A -> A [label = "self", rightnote = "note"];'
+                  'B -> C [rightnote = "very very very long note"]; }')
+        diagram, metrics = build(source)
+        pagesize = metrics.pagesize()
+        for edge in diagram.edges:
+            layout = metrics.edge_layout(edge)
+            if edge.leftnote:
+                self.assertGreaterEqual(layout.leftnotebox.x1, 0)
+            if edge.rightnote:
+                self.assertLessEqual(layout.rightnotebox.x2, pagesize.width)
+
+    def test_row_heights_after_right_note(self):
+        diagram, metrics = build('{ A -> B; A -> B [note = "note"]; '
+                                 'A -> B; }')
+        heights = metrics.spreadsheet.node_height
+        self.assertLess(heights[1], metrics.node_height)
+        self.assertEqual(metrics.node_height, heights[3])
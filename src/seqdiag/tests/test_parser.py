@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import glob
+import io
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from funcparserlib.lexer import LexerError
+
+from seqdiag import parser
+
+
+def get_sources():
+    basedir = os.path.dirname(__file__)
+    patterns = [os.path.join(basedir, 'diagrams', '*.diag'),
+                os.path.join(basedir, '..', '..', '..', 'examples', '*.diag')]
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            with io.open(path, 'r', encoding='utf-8-sig') as fp:
+                yield path, fp.read()
+
+
+class TestParser(unittest.TestCase):
+    def test_parse_string(self):
+        tree = parser.parse_string('{ A -> B [label = "hello"]; }')
+        self.assertIsInstance(tree, parser.Diagram)
+
+        edge = tree.stmts[0]
+        self.assertIsInstance(edge, parser.Edge)
+        self.assertEqual('A', edge.from_node)
+        self.assertEqual('->', edge.edge_type)
+        self.assertEqual('B', edge.to_node)
+        self.assertEqual([parser.Attr('label', '"hello"')], edge.attrs)
+
+    def test_parser_is_reusable(self):
+        p = parser.Parser()
+        tree1 = p.parse_string('{ A -> B; }')
+        tree2 = p.parse_string('seqdiag { C -> D; }')
+
+        self.assertEqual(parser.parse_string('{ A -> B; }'), tree1)
+        self.assertEqual(parser.parse_string('seqdiag { C -> D; }'), tree2)
+
+    def test_parse_error(self):
+        p = parser.Parser()
+        with self.assertRaises(parser.ParseException):
+            p.parse_string('{ A -> ; }')
+        with self.assertRaises(parser.ParseException):
+            p.parse_string('{ A -> B; ! }')
+
+        # parser should be still available after errors
+        self.assertEqual(parser.parse_string('{ A; }'),
+                         p.parse_string('{ A; }'))
+
+    def test_shared_between_threads(self):
+        sources = ['{ N%d -> N%d [label = "%d"]; }' % (i, i + 1, i)
+                   for i in range(200)]
+        expected = [parser.Parser().parse_string(s) for s in sources]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(parser.parse_string, sources))
+
+        self.assertEqual(expected, results)
+
+
+class TestFastTokenizer(unittest.TestCase):
+    def setUp(self):
+        self.reference = parser.Parser()
+        self.fast = parser.Parser(fast_lexer=True)
+
+    def assertSameTokens(self, string):
+        def tokens(p):
+            return [(t.type, t.value, t.start, t.end)
+                    for t in p.tokenize(string)]
+
+        self.assertEqual(tokens(self.reference), tokens(self.fast))
+
+    def assertSameError(self, string):
+        with self.assertRaises(LexerError) as expected:
+            self.reference.tokenize(string)
+        with self.assertRaises(LexerError) as actual:
+            self.fast.tokenize(string)
+
+        self.assertEqual(expected.exception.place, actual.exception.place)
+        self.assertEqual(str(expected.exception), str(actual.exception))
+
+    def test_diagram_files(self):
+        sources = list(get_sources())
+        self.assertTrue(sources)
+        for path, source in sources:
+            with self.subTest(path=path):
+                self.assertSameTokens(source)
+                self.assertEqual(self.reference.parse_string(source),
+                                 self.fast.parse_string(source))
+
+    def test_tokens(self):
+        self.assertSameTokens('')
+        self.assertSameTokens('{ A -> B; }')
+        self.assertSameTokens('{\r\n  A <<-- B;\r\n  B =>C}')
+        self.assertSameTokens('/* multi\nline\ncomment */ { # comment\n}')
+        self.assertSameTokens('{ A [label = """multi\n\nline"""];\n}\n')
+        self.assertSameTokens("{ A [label = 'quo\\'ted'] }")
+        self.assertSameTokens('{\n=== sep ===\n... delay ...\n}')
+        self.assertSameTokens('{ A [width = -.5, height = 1.25]; }')
+        self.assertSameTokens('{ \u3042 -> \u3044; }')
+
+    def test_errors(self):
+        self.assertSameError('{ A -> B; ! }')
+        self.assertSameError('{\n  A -> B;\n  /* comment\n */ ?? }')
+        self.assertSameError('{ "unterminated }')
+        self.assertSameError('a\rb\r\n$')
+
+
+class TestIterparse(unittest.TestCase):
+    def assertSameTree(self, string):
+        expected = parser.parse_string(string)
+        for p in (parser.Parser(), parser.Parser(fast_lexer=True)):
+            tree = p.iterparse_string(string)
+            self.assertEqual(expected.id, tree.id)
+            self.assertEqual(expected.stmts, list(tree.stmts))
+
+    def test_diagram_files(self):
+        for path, source in get_sources():
+            with self.subTest(path=path):
+                self.assertSameTree(source)
+
+    def test_statements(self):
+        self.assertSameTree('{}')
+        self.assertSameTree('diagram foo { A; }')
+        self.assertSameTree('{ A -> B C -> D; E [color = red] }')
+        self.assertSameTree('{ A -> B { B -> C }; D -> E }')
+        self.assertSameTree('{ A -> B {} D -> E; loop { E -> F } }')
+        self.assertSameTree('{ group { A; B; color = red } C -> D; }')
+
+    def test_hoisted_statements(self):
+        source = ('{ A -> B [class = red]; default_fontsize = 20; '
+                  'loop { B -> C; color = blue; } class red [color = red]; '
+                  'plugin autoclass }')
+        self.assertSameTree(source)
+
+        stmts = parser.iterparse_string(source).stmts
+        self.assertIsInstance(next(stmts), parser.Attr)
+        self.assertIsInstance(next(stmts), parser.Extension)
+        self.assertIsInstance(next(stmts), parser.Extension)
+        self.assertIsInstance(next(stmts), parser.Edge)
+
+        fragment = next(stmts)
+        self.assertIsInstance(fragment, parser.Fragment)
+        self.assertIsInstance(fragment.stmts[0], parser.Attr)
+
+    def test_statements_are_parsed_lazily(self):
+        tree = parser.iterparse_string('{ A -> B; B -> C; C -> ; }')
+
+        self.assertEqual('A', next(tree.stmts).from_node)
+        self.assertEqual('B', next(tree.stmts).from_node)
+        with self.assertRaises(parser.ParseException):
+            next(tree.stmts)
+
+    def test_errors(self):
+        with self.assertRaises(parser.ParseException):
+            parser.iterparse_string('seqdiag')
+        with self.assertRaises(parser.ParseException):
+            parser.iterparse_string('diagram ! { }')
+
+        for source in ('{ A -> B; ', '{ A -> B; } }', '{ A; ! }'):
+            tree = parser.iterparse_string(source)
+            with self.assertRaises(parser.ParseException):
+                list(tree.stmts)
+
+
+class TestSortTree(unittest.TestCase):
+    def test_sort_tree(self):
+        tree = parser.Diagram(None, [
+            parser.Node('A', []),
+            parser.Attr('default_fontsize', '16'),
+            parser.Fragment('loop', None, [
+                parser.Edge('A', '->', 'B', [], [], None),
+                parser.Attr('color', 'red'),
+                parser.Edge('B', '->', 'C', [], [], None),
+            ]),
+            parser.Extension('class', 'red', []),
+            parser.Node('B', []),
+            parser.Attr('edge_length', '300'),
+        ])
+
+        sorted_tree = parser.sort_tree(tree)
+        self.assertIs(tree, sorted_tree)
+        self.assertEqual([parser.Attr('default_fontsize', '16'),
+                          parser.Extension('class', 'red', []),
+                          parser.Attr('edge_length', '300'),
+                          parser.Node('A', [])],
+                         tree.stmts[:4])
+        self.assertIsInstance(tree.stmts[4], parser.Fragment)
+        self.assertEqual(parser.Node('B', []), tree.stmts[5])
+
+        fragment = tree.stmts[4]
+        self.assertEqual([parser.Attr('color', 'red'),
+                          parser.Edge('A', '->', 'B', [], [], None),
+                          parser.Edge('B', '->', 'C', [], [], None)],
+                         fragment.stmts)
+
+    def test_deeply_nested_blocks(self):
+        depth = 10000
+        edge = parser.Edge('A', '->', 'B', [], [], None)
+        attr = parser.Attr('color', 'red')
+
+        tree = innermost = parser.Diagram(None, [])
+        for _ in range(depth):
+            fragment = parser.Fragment('alt', None, [])
+            innermost.stmts.extend([edge, fragment, attr])
+            innermost = fragment
+
+        parser.sort_tree(tree)
+
+        block = tree
+        for _ in range(depth):
+            self.assertEqual([attr, edge], block.stmts[:2])
+            block = block.stmts[2]
+        self.assertEqual([], block.stmts)
+
+    def test_flat_statements(self):
+        count = 1000000
+        node = parser.Node('A', [])
+        attr = parser.Attr('color', 'red')
+        tree = parser.Diagram(None, [node, attr] * (count // 2))
+
+        parser.sort_tree(tree)
+        self.assertEqual(count, len(tree.stmts))
+        self.assertEqual([attr] * (count // 2), tree.stmts[:count // 2])
+        self.assertEqual([node] * (count // 2), tree.stmts[count // 2:])
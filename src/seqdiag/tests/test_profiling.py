@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import io
+import time
+import unittest
+
+from seqdiag.utils.profiling import PhaseStats, StackSampler
+
+
+class TestPhaseStats(unittest.TestCase):
+    def test_phase(self):
+        stats = PhaseStats()
+        with stats.phase('parse'):
+            pass
+        with stats.phase('build'):
+            time.sleep(0.01)
+        with stats.phase('parse'):
+            pass
+
+        self.assertEqual(['parse', 'build'], list(stats.phases))
+        elapsed, _ = stats.phases['build']
+        self.assertTrue(elapsed >= 0.01)
+
+    def test_trace_memory(self):
+        stats = PhaseStats(trace_memory=True)
+        with stats.phase('allocate'):
+            data = bytearray(4 * 1024 * 1024)
+            del data
+        with stats.phase('idle'):
+            pass
+
+        self.assertGreaterEqual(stats.phases['allocate'][1], 4 * 1024 * 1024)
+        self.assertLess(stats.phases['idle'][1], 1024 * 1024)
+
+    def test_rss_growth(self):
+        stats = PhaseStats()
+        with stats.phase('allocate'):
+            data = bytearray(64 * 1024 * 1024)
+            data[::4096] = b'x' * len(data[::4096])  # touch the pages
+            del data
+        with stats.phase('idle'):
+            pass
+
+        if stats.phases['idle'][1] is not None:  # getrusage() is available
+            self.assertGreater(stats.phases['allocate'][1], 0)
+            self.assertEqual(0, stats.phases['idle'][1])
+
+    def test_phase_with_error(self):
+        stats = PhaseStats()
+        with self.assertRaises(ValueError):
+            with stats.phase('parse'):
+                raise ValueError
+
+        self.assertEqual(['parse'], list(stats.phases))
+
+    def test_report(self):
+        stats = PhaseStats()
+        with stats.phase('parse'):
+            pass
+        stats.count('edges', 3)
+        stats.count('canvas', '100x200')
+
+        stream = io.StringIO()
+        stats.report(stream)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(['phase', 'parse', 'total', 'edges:', 'canvas:'],
+                         [line.split()[0] for line in lines])
+        self.assertEqual('edges: 3', lines[3])
+        self.assertEqual('canvas: 100x200', lines[4])
+
+
+class TestStackSampler(unittest.TestCase):
+    def busy(self):
+        started = time.perf_counter()
+        while time.perf_counter() - started < 0.1:
+            pass
+
+    def test_sampling(self):
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            self.busy()
+        finally:
+            sampler.stop()
+
+        self.assertTrue(sampler.stacks)
+        stacks = [stack for stack in sampler.stacks if 'busy (' in stack]
+        self.assertTrue(stacks)
+        for stack in stacks:
+            self.assertIn('test_sampling (', stack.split(';')[-2])
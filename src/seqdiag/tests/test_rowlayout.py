@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import random
+import unittest
+
+from seqdiag import rowlayout
+from seqdiag.rowlayout import NumPyBackend, PythonBackend, get_backend
+
+
+class TestPythonBackend(unittest.TestCase):
+    backend = PythonBackend()
+
+    def test_edge_heights(self):
+        heights = self.backend.edge_heights([10, 30, 10, 10, 50],
+                                            [0, 40, 0, 0, 0],
+                                            [0, 0, 20, 0, 0], 40, 3)
+        self.assertEqual([10, 40, 20, 40, 50], heights)
+
+        self.assertEqual([], self.backend.edge_heights([], [], [], 40, 0))
+
+    def test_block_spans(self):
+        # blocks at rows 1-3 (level 2), 1-2 (level 1) and 5-9 (beyond rows)
+        tops = [(1, 2), (1, 1), (5, 1)]
+        bottoms = [(3, 1), (2, 1), (9, 1)]
+        spans = self.backend.block_spans(5, tops, bottoms, 8)
+        self.assertEqual({2: 28, 4: 0, 5: 0, 6: 8}, spans)
+
+        # the span below the bottom and above the next top
+        spans = self.backend.block_spans(5, [(3, 1)], [(2, 2)], 8)
+        self.assertEqual({4: 12}, spans)
+
+        self.assertEqual({}, self.backend.block_spans(5, [], [], 8))
+
+    def test_offsets(self):
+        tops, bottoms = self.backend.offsets([40, 10, 20], [40, 5, 0])
+        self.assertEqual([40, 85, 95], tops)
+        self.assertEqual([80, 95, 115], bottoms)
+
+    def test_random(self):
+        rand = random.Random(0)
+        backend = PythonBackend()
+        for _ in range(50):
+            rows = rand.randrange(1, 30)
+            heights = [rand.randrange(10, 60) for _ in range(rows)]
+            leftnotes = [rand.choice([0, 0, 30, 70]) for _ in range(rows)]
+            rightnotes = [rand.choice([0, 0, 30, 70]) for _ in range(rows)]
+            start = rand.randrange(rows + 1)
+            self.assertEqual(
+                backend.edge_heights(heights, leftnotes, rightnotes, 40,
+                                     start),
+                self.backend.edge_heights(heights, leftnotes, rightnotes, 40,
+                                          start))
+
+            tops = [(rand.randrange(rows + 3), rand.randrange(1, 4))
+                    for _ in range(rand.randrange(10))]
+            bottoms = [(rand.randrange(rows + 3), rand.randrange(1, 4))
+                       for _ in range(rand.randrange(10))]
+            self.assertEqual(backend.block_spans(rows, tops, bottoms, 8),
+                             self.backend.block_spans(rows, tops, bottoms, 8))
+
+            spans = [rand.randrange(50) for _ in range(rows)]
+            self.assertEqual(backend.offsets(heights, spans),
+                             self.backend.offsets(heights, spans))
+
+
+@unittest.skipIf(rowlayout.numpy is None, "numpy is not installed")
+class TestNumPyBackend(TestPythonBackend):
+    backend = NumPyBackend()
+
+    def test_types(self):
+        heights = self.backend.edge_heights([10], [40], [0], 40, 0)
+        self.assertIs(int, type(heights[0]))
+
+        spans = self.backend.block_spans(5, [(1, 1)], [], 8)
+        self.assertEqual([(int, int)],
+                         [(type(y), type(h)) for y, h in spans.items()])
+
+        tops, bottoms = self.backend.offsets([40], [40])
+        self.assertIs(int, type(tops[0]))
+        self.assertIs(int, type(bottoms[0]))
+
+
+class TestGetBackend(unittest.TestCase):
+    def test_get_backend(self):
+        self.assertIsInstance(get_backend('python'), PythonBackend)
+        self.assertEqual('python', get_backend().name)
+        if rowlayout.numpy is None:
+            with self.assertRaises(RuntimeError):
+                get_backend('numpy')
+        else:
+            self.assertEqual('numpy', get_backend('numpy').name)
+
+        with self.assertRaises(ValueError):
+            get_backend('fortran')
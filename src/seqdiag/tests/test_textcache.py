@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import shutil
+import unittest
+
+import blockdiag
+import PIL
+from blockdiag import imagedraw
+from blockdiag.tests.utils import TemporaryDirectory
+from blockdiag.utils.fontmap import FontInfo, FontMap
+
+from seqdiag.utils.diskcache import DiskCache
+from seqdiag.utils.textcache import TextCache
+
+
+class TestTextCache(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = TemporaryDirectory()
+        self.drawer = imagedraw.create('SVG', None)
+        self.font = FontMap().find()
+
+    def tearDown(self):
+        self._tmpdir.clean()
+
+    def test_textsize(self):
+        cache = TextCache()
+        expected = self.drawer.textsize('hello world', self.font, 30)
+
+        self.assertEqual(expected, cache.textsize(self.drawer, 'hello world',
+                                                  self.font, 30))
+        self.assertEqual(expected, cache.textsize(self.drawer, 'hello world',
+                                                  self.font, 30))
+        self.assertNotEqual(expected, cache.textsize(self.drawer,
+                                                     'hello world',
+                                                     self.font, 65535))
+        self.assertEqual({'hits': 1, 'misses': 2, 'entries': 2},
+                         cache.stats())
+
+    def test_shared_between_drawers(self):
+        cache = TextCache()
+        for _ in range(2):
+            drawer = imagedraw.create('SVG', None, filters=['linejump'])
+            cache.textsize(drawer, 'hello', self.font, 100)
+
+        cache.textsize(imagedraw.create('PNG', None), 'hello', self.font, 100)
+        self.assertEqual({'hits': 1, 'misses': 2, 'entries': 2},
+                         cache.stats())
+
+    def test_lru(self):
+        cache = TextCache(max_entries=2)
+        cache.textsize(self.drawer, 'a', self.font, 100)
+        cache.textsize(self.drawer, 'b', self.font, 100)
+        cache.textsize(self.drawer, 'a', self.font, 100)
+        cache.textsize(self.drawer, 'c', self.font, 100)  # evicts 'b'
+        self.assertEqual(2, len(cache))
+
+        cache.textsize(self.drawer, 'a', self.font, 100)
+        cache.textsize(self.drawer, 'b', self.font, 100)
+        self.assertEqual({'hits': 2, 'misses': 4, 'entries': 2},
+                         cache.stats())
+
+    def test_store(self):
+        store = DiskCache(self._tmpdir.name)
+        cache = TextCache(store=store)
+        size = cache.textsize(self.drawer, 'hello', self.font, 100)
+        cache.save()
+
+        cache = TextCache(store=store)
+        cache.load()
+        self.assertEqual(size, cache.textsize(self.drawer, 'hello',
+                                              self.font, 100))
+        self.assertEqual({'hits': 1, 'misses': 0, 'entries': 1},
+                         cache.stats())
+
+        store.set(cache.store_key, b'broken')
+        TextCache(store=store).load()
+        self.assertIsNone(store.get(cache.store_key))
+
+    def test_store_key(self):
+        key = TextCache().store_key
+        self.assertIn(blockdiag.__version__, key)
+        self.assertIn(PIL.__version__, key)
+
+    def test_store_with_modified_font(self):
+        fontpath = os.path.join(os.path.dirname(__file__), 'VLGothic',
+                                'VL-Gothic-Regular.ttf')
+        path = os.path.join(self._tmpdir.name, 'font.ttf')
+        shutil.copy(fontpath, path)
+        font = FontInfo('sansserif', path, 11)
+        drawer = imagedraw.create('PNG', None)
+
+        store = DiskCache(os.path.join(self._tmpdir.name, 'cache'))
+        cache = TextCache(store=store)
+        cache.textsize(drawer, 'hello', font, 100)
+        cache.save()
+
+        cache = TextCache(store=store)
+        cache.load()
+        cache.textsize(drawer, 'hello', font, 100)
+        self.assertEqual(1, cache.stats()['hits'])
+
+        # replace the font file
+        stat = os.stat(path)
+        with open(path, 'ab') as fp:
+            fp.write(b'\0')
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        cache = TextCache(store=store)
+        cache.load()
+        cache.textsize(drawer, 'hello', font, 100)
+        self.assertEqual({'hits': 0, 'misses': 1, 'entries': 2},
+                         cache.stats())
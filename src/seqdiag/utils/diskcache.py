@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import hashlib
+import os
+import random
+import tempfile
+import time
+
+from blockdiag.utils.logging import warning
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024  # 64MB
+
+
+class DiskCache(object):
+    """A size-bounded key-value store on the filesystem
+
+    Each entry is stored in its own file named by the SHA-256 of its key.
+    Files are written to a temporary file and renamed into place, so any
+    number of processes can share the directory.  When the total size
+    exceeds *max_size*, the least recently used entries are removed.
+
+    Failures to read or write the cache are never fatal; the entry is
+    treated as missing.  *hits* and *misses* count the results of get().
+    """
+    suffix = '.cache'
+    tmp_suffix = '.tmp'
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def filename(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest + self.suffix)
+
+    def get(self, key):
+        path = self.filename(key)
+        try:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass  # removed by other process
+
+        return data
+
+    def set(self, key, data):
+        tmpname = None
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path, exist_ok=True)
+
+            fd, tmpname = tempfile.mkstemp(dir=self.path, prefix='.',
+                                           suffix=self.tmp_suffix)
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+
+            os.replace(tmpname, self.filename(key))
+        except OSError as exc:
+            warning("could not write cache: %s", exc)
+            if tmpname and os.path.exists(tmpname):
+                os.unlink(tmpname)
+            return
+
+        # Counting the total size requires a scan of the directory.  Instead
+        # of scanning on each write, scan with a probability proportional to
+        # the size of the entry; in average, once per max_size / 10 bytes
+        # written by all processes sharing the cache.
+        if random.random() < len(data) * 10.0 / self.max_size:
+            self.evict()
+
+    def delete(self, key):
+        try:
+            os.unlink(self.filename(key))
+        except OSError:
+            pass
+
+    def entries(self):
+        """Returns (mtime, size, path) for each entry; oldest first"""
+        entries = []
+        expired = time.time() - 3600
+        try:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    try:
+                        stat = entry.stat()
+                        if entry.name.endswith(self.suffix):
+                            entries.append((stat.st_mtime, stat.st_size,
+                                            entry.path))
+                        elif (entry.name.endswith(self.tmp_suffix) and
+                              stat.st_mtime < expired):
+                            # left by a crashed process
+                            os.unlink(entry.path)
+                    except OSError:
+                        pass  # removed by other process
+        except OSError:
+            pass
+
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Remove the least recently used entries to fit in max_size"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_size:
+            return
+
+        low_water = self.max_size * 9 // 10
+        for _, size, path in entries:
+            if total <= low_water:
+                break
+
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
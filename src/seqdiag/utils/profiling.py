@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import cProfile
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss():
+    """Returns the peak resident set size of the process in bytes"""
+    if resource is None:
+        return None
+
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return usage  # in bytes
+    else:
+        return usage * 1024  # in kilobytes
+
+
+class PhaseStats(object):
+    """Wall time and memory usage of each phase of rendering a diagram
+
+    By default, the memory usage of a phase is the growth of the peak
+    resident set size of the process in the phase; it is 0 if the phase
+    fits in the memory used by the earlier phases.  With *trace_memory*,
+    the memory allocated by Python is traced with tracemalloc instead, and
+    the peak of the memory allocated in each phase is recorded; it is
+    exact, but tracing slows down the rendering several times.  Other
+    statistics (counts of elements, cache hits and so on) are kept in
+    *counters* in order of addition.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.phases = OrderedDict()
+        self.counters = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        started_tracing = False
+        if not self.trace_memory:
+            baseline = peak_rss()
+        elif not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracing = True
+        elif hasattr(tracemalloc, 'reset_peak'):  # python 3.9+
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        else:
+            baseline = None  # traced by others; the peak is unknown
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            if started_tracing:
+                memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            elif baseline is None:
+                memory = None
+            elif self.trace_memory:
+                memory = tracemalloc.get_traced_memory()[1] - baseline
+            else:
+                memory = peak_rss() - baseline
+
+            elapsed += self.phases.get(name, (0, None))[0]
+            self.phases[name] = (elapsed, memory)
+
+    def count(self, name, value):
+        self.counters[name] = value
+
+    def report(self, stream):
+        if self.trace_memory:
+            memory = 'peak memory'
+        else:
+            memory = 'RSS growth'
+        stream.write("%-10s %10s %12s\n" % ('phase', 'time', memory))
+        for name, (elapsed, usage) in self.phases.items():
+            if usage is None:
+                usage = '-'
+            else:
+                usage = '%.1fMB' % (usage / 1024.0 / 1024.0)
+            stream.write("%-10s %8.1fms %12s\n" % (name, elapsed * 1000,
+                                                   usage))
+
+        total = sum(elapsed for elapsed, _ in self.phases.values())
+        stream.write("%-10s %8.1fms\n" % ('total', total * 1000))
+
+        for name, value in self.counters.items():
+            stream.write("%s: %s\n" % (name, value))
+
+
+class StackSampler(object):
+    """A sampling profiler writing stacks in the collapsed format
+
+    A background thread takes the stack of *thread_id* (the current thread
+    by default) each *interval* seconds; as it needs the GIL, the samples
+    are taken at most once per sys.getswitchinterval() while the profiled
+    thread is busy.  save() writes a line per distinct stack as
+    "outer;...;inner count", which flamegraph.pl, speedscope and similar
+    tools read.
+    """
+
+    def __init__(self, interval=0.001, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append('%s (%s:%d)' % (code.co_name,
+                                             os.path.basename(code.co_filename),
+                                             code.co_firstlineno))
+                frame = frame.f_back
+
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def save(self, path):
+        with open(path, 'w') as fp:
+            for stack, count in sorted(self.stacks.items()):
+                fp.write('%s %d\n' % (stack, count))
+
+
+class Profiler(object):
+    """Profile the code until stopped; cProfile or StackSampler
+
+    If *path* ends with .folded or .collapsed, the stacks are sampled and
+    written in the collapsed format for flame graphs; otherwise the stats
+    of cProfile are dumped (to be read by pstats).
+    """
+
+    collapsed_suffixes = ('.folded', '.collapsed')
+
+    def __init__(self, path):
+        self.path = path
+        if path.endswith(self.collapsed_suffixes):
+            self.profiler = StackSampler()
+        else:
+            self.profiler = cProfile.Profile()
+
+    def start(self):
+        if isinstance(self.profiler, StackSampler):
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self):
+        if isinstance(self.profiler, StackSampler):
+            self.profiler.stop()
+            self.profiler.save(self.path)
+        else:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.path)
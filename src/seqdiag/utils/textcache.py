@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2011 Takeshi KOMIYA
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+import blockdiag
+import PIL
+from blockdiag.imagedraw.filters.linejump import LazyReceiver
+from blockdiag.utils import Size
+
+import seqdiag
+
+DEFAULT_MAX_ENTRIES = 65536
+
+
+class TextCache(object):
+    """An LRU cache of the sizes of wrapped texts
+
+    Sizes are keyed by the text, the font (path, family and size), the
+    width to wrap the text in, and the kind of the drawer (its class,
+    scale ratio and baseline rendering), so one cache can be shared by
+    any number of diagrams and drawers; it is thread-safe.
+
+    *store* is a seqdiag.utils.diskcache.DiskCache to keep the sizes across
+    runs.  load() reads the stored sizes into the cache and save() writes
+    the cache back if it has new entries.  The stored sizes are keyed by
+    the versions of seqdiag, blockdiag and Pillow, and each size by the
+    modification time and the size of its font file, so upgrading them
+    or replacing a font discards the sizes measured before.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, store=None):
+        self.max_entries = max_entries
+        self.store = store
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.modified = False
+        self.font_stamps = {}  # path of font -> (resolved path, stamp)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def font_stamp(self, path):
+        """Returns the resolved path of the font file and its stamp"""
+        stamp = self.font_stamps.get(path)
+        if stamp is None:
+            if path is None:
+                stamp = (None, None)
+            else:
+                realpath = os.path.realpath(path)
+                try:
+                    stat = os.stat(realpath)
+                    stamp = (realpath, '%d:%d' % (stat.st_mtime_ns,
+                                                  stat.st_size))
+                except OSError:
+                    stamp = (realpath, None)
+
+            self.font_stamps[path] = stamp
+
+        return stamp
+
+    def key(self, drawer, string, font, width):
+        while isinstance(drawer, LazyReceiver):  # unwrap filters
+            drawer = drawer.target
+
+        drawer_key = '%s.%s:%s:%s' % (type(drawer).__module__,
+                                      type(drawer).__name__,
+                                      getattr(drawer, 'scale_ratio', 1),
+                                      drawer.baseline_text_rendering)
+        font_path, font_stamp = self.font_stamp(font.path)
+        return (drawer_key, string, font_path, font_stamp, font.familyname,
+                font.size, width)
+
+    def textsize(self, drawer, string, font, width):
+        """Measure *string* by *drawer*, or return the cached size"""
+        if font is None:
+            return drawer.textsize(string, font, maxwidth=width)
+
+        key = self.key(drawer, string, font, width)
+        with self.lock:
+            size = self.entries.get(key)
+            if size is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return size
+
+        size = Size(*drawer.textsize(string, font, maxwidth=width))
+        with self.lock:
+            self.misses += 1
+            self.add(key, size)
+            self.modified = True
+
+        return size
+
+    def add(self, key, size):
+        self.entries[key] = size
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        """Returns the counters of the cache as a dict"""
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self.entries)}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.modified = False
+            self.font_stamps.clear()
+
+    @property
+    def store_key(self):
+        return 'seqdiag-%s:blockdiag-%s:pillow-%s:textsize' % \
+            (seqdiag.__version__, blockdiag.__version__, PIL.__version__)
+
+    def load(self):
+        if self.store is None:
+            return
+
+        data = self.store.get(self.store_key)
+        if data is None:
+            return
+
+        try:
+            entries = json.loads(zlib.decompress(data).decode('utf-8'))
+        except Exception:
+            self.store.delete(self.store_key)  # broken entry
+            return
+
+        with self.lock:
+            for entry in entries:
+                key = tuple(entry[:-2])
+                if key not in self.entries:
+                    self.add(key, Size(*entry[-2:]))
+                    self.entries.move_to_end(key, last=False)
+
+    def save(self):
+        if self.store is None or not self.modified:
+            return
+
+        with self.lock:
+            entries = [list(key) + list(size)
+                       for key, size in self.entries.items()]
+            self.modified = False
+
+        data = json.dumps(entries).encode('utf-8')
+        self.store.set(self.store_key, zlib.compress(data, 1))
+
+
+default_cache = TextCache()